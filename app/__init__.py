@@ -5,7 +5,9 @@ from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
+from app.cache import TTLCache
 from app.config import config
+from app.venues import FoursquareClient, VenueCache
 
 # Initialize extensions
 db = SQLAlchemy()
@@ -30,6 +32,41 @@ def create_app(config_name="default"):
     migrate.init_app(app, db)
     login_manager.init_app(app)
 
+    # Cache of validated API keys, shared by the requests of this process
+    app.extensions["api_key_cache"] = TTLCache(
+        maxsize=app.config["API_KEY_CACHE_SIZE"], ttl=app.config["API_KEY_CACHE_TTL"]
+    )
+    # Simplified GPS tracks, keyed on the day's point count so new points miss
+    app.extensions["track_cache"] = TTLCache(
+        maxsize=app.config["TRACK_CACHE_SIZE"], ttl=app.config["TRACK_CACHE_TTL"]
+    )
+    # Trips of each day, keyed on the day's point count so new points miss
+    app.extensions["trip_cache"] = TTLCache(
+        maxsize=app.config["TRIP_CACHE_SIZE"], ttl=app.config["TRIP_CACHE_TTL"]
+    )
+    # Newest archived day of each user, so inserts of newer points skip the
+    # archive lookup
+    app.extensions["archive_day_cache"] = TTLCache(
+        maxsize=app.config["ARCHIVE_DAY_CACHE_SIZE"],
+        ttl=app.config["ARCHIVE_DAY_CACHE_TTL"],
+    )
+    # Spatial index of each user's saved locations
+    app.extensions["location_index_cache"] = TTLCache(
+        maxsize=app.config["LOCATION_INDEX_CACHE_SIZE"],
+        ttl=app.config["LOCATION_INDEX_CACHE_TTL"],
+    )
+
+    # Foursquare venue searches, shared with the other workers on this host
+    app.extensions["venue_cache"] = VenueCache(
+        app.config.get("FOURSQUARE_CACHE_PATH")
+        or os.path.join(app.instance_path, "foursquare_cache.sqlite"),
+        ttl=app.config["FOURSQUARE_CACHE_TTL"],
+        max_entries=app.config["FOURSQUARE_CACHE_SIZE"],
+        logger=app.logger,
+    )
+    # Pooled, circuit-broken Foursquare search client
+    app.extensions["foursquare"] = FoursquareClient(app, app.extensions["venue_cache"])
+
     # Import models to ensure they're known to SQLAlchemy
     from app import model
 
@@ -37,9 +74,28 @@ def create_app(config_name="default"):
     def load_user(user_id):
         return model.User.query.get(int(user_id))
 
+    from app.jobs import JobRunner
+
+    # Runs uploaded file imports outside of the request
+    app.extensions["job_runner"] = JobRunner(app)
+
+    if app.config["GPS_INGEST_MODE"] == "spool":
+        from app.spool import GPSSpool
+
+        # The flusher thread is started on first use, but points left behind
+        # by processes that died are inserted now
+        app.extensions["gps_spool"] = GPSSpool(app)
+        app.extensions["gps_spool"].recover()
+
     # Register blueprints
     from .routes import main_bp
 
     app.register_blueprint(main_bp)
 
+    # Register CLI commands
+    from .cli import cli_commands
+
+    for command in cli_commands:
+        app.cli.add_command(command)
+
     return app
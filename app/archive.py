@@ -0,0 +1,478 @@
+import heapq
+import itertools
+import json
+import math
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import pytz
+from flask import current_app
+from gpxpy.geo import haversine_distance
+from sqlalchemy import and_, delete, func, or_, select
+
+from . import db
+from .grid import bbox_around, cell_ranges
+from .model import GPSArchive, GPSPosition
+from .tracks import EPOCH, STREAM_BATCH_SIZE, in_bbox, positions_query
+
+ARCHIVE_FORMAT_VERSION = 1
+
+# positions_near reads areas of up to this many grid cells one cell at a time
+NEAR_CELL_QUERIES = 16
+
+# Every column of GPSPosition except user_id
+ArchivedPosition = namedtuple(
+    "ArchivedPosition",
+    [
+        "id",
+        "timestamp",
+        "latitude",
+        "longitude",
+        "altitude",
+        "accuracy",
+        "speed",
+        "bearing",
+        "provider",
+        "source",
+    ],
+)
+
+ARCHIVE_COLUMNS = [getattr(GPSPosition, name) for name in ArchivedPosition._fields]
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _deltas(values):
+    previous = 0
+    for value in values:
+        yield value - previous
+        previous = value
+
+
+def pack_positions(positions):
+    """Pack positions, sorted by timestamp, into a compressed blob.
+
+    Each column is stored as its own array so similar values sit together:
+    ids, microsecond timestamps and 1e-7 degree coordinates as 64-bit deltas
+    from the previous point (a step across the antimeridian does not fit in
+    32 bits), the other measurements as float32 with NaN for missing values,
+    and provider and source as indexes into a string table.
+    """
+    strings = [None]
+    string_index = {None: 0}
+
+    def encode_string(value):
+        if value not in string_index:
+            string_index[value] = len(strings)
+            strings.append(value)
+        return string_index[value]
+
+    def encode_float(value):
+        return math.nan if value is None else value
+
+    columns = [
+        array("q", _deltas(pos.id for pos in positions)),
+        array(
+            "q",
+            _deltas(
+                (pos.timestamp - EPOCH) // timedelta(microseconds=1)
+                for pos in positions
+            ),
+        ),
+        array("q", _deltas(round(pos.latitude * 10**7) for pos in positions)),
+        array("q", _deltas(round(pos.longitude * 10**7) for pos in positions)),
+        array("f", (encode_float(pos.altitude) for pos in positions)),
+        array("f", (encode_float(pos.accuracy) for pos in positions)),
+        array("f", (encode_float(pos.speed) for pos in positions)),
+        array("f", (encode_float(pos.bearing) for pos in positions)),
+        array("H", (encode_string(pos.provider) for pos in positions)),
+        array("H", (encode_string(pos.source) for pos in positions)),
+    ]
+
+    header = json.dumps(
+        {
+            "version": ARCHIVE_FORMAT_VERSION,
+            "count": len(positions),
+            "strings": strings,
+        }
+    ).encode()
+    body = [struct.pack("<I", len(header)), header]
+    body.extend(_to_little_endian(column) for column in columns)
+    return zlib.compress(b"".join(body), 9)
+
+
+def unpack_positions(data):
+    """Unpack a blob made by pack_positions into a list of ArchivedPosition"""
+    body = zlib.decompress(data)
+    (header_length,) = struct.unpack_from("<I", body)
+    header = json.loads(body[4 : 4 + header_length])
+    if header["version"] != ARCHIVE_FORMAT_VERSION:
+        raise ValueError(f"Unknown GPS archive version {header['version']}")
+
+    count = header["count"]
+    strings = header["strings"]
+    offset = 4 + header_length
+
+    def read(typecode):
+        nonlocal offset
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(body[offset : offset + size])
+        if sys.byteorder == "big":
+            values.byteswap()
+        offset += size
+        return values
+
+    def decode_float(value):
+        # float32 holds about 7 significant digits; rounding to them turns
+        # 1.399999976 back into the 1.4 that was stored
+        return None if math.isnan(value) else float(f"{value:.7g}")
+
+    ids = itertools.accumulate(read("q"))
+    timestamps = (
+        EPOCH + timedelta(microseconds=value)
+        for value in itertools.accumulate(read("q"))
+    )
+    latitudes = (value / 10**7 for value in itertools.accumulate(read("q")))
+    longitudes = (value / 10**7 for value in itertools.accumulate(read("q")))
+    floats = [map(decode_float, read("f")) for _ in range(4)]
+    providers = (strings[index] for index in read("H"))
+    sources = (strings[index] for index in read("H"))
+    if offset != len(body):
+        raise ValueError("GPS archive columns do not match its point count")
+
+    return [
+        ArchivedPosition(*values)
+        for values in zip(
+            ids, timestamps, latitudes, longitudes, *floats, providers, sources
+        )
+    ]
+
+
+def position_key(pos):
+    """The (timestamp, id) that positions are ordered and paginated by"""
+    return pos.timestamp, pos.id
+
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(pytz.UTC).replace(tzinfo=None)
+    return value
+
+
+def archived_positions(
+    user_id, start=None, end=None, bbox=None, after=None, newest_first=False
+):
+    """Yield a user's archived positions, ordered by (timestamp, id).
+
+    Takes the same filters as tracks.positions_query; ``after`` only applies
+    oldest first. Archives are loaded one day at a time as the positions are
+    read, and archives outside ``bbox`` are not loaded at all.
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    if after:
+        after = (_naive_utc(after[0]), after[1])
+
+    query = select(GPSArchive.id).where(GPSArchive.user_id == user_id)
+    if start:
+        query = query.where(GPSArchive.day >= start.date())
+    if end:
+        query = query.where(GPSArchive.day <= end.date())
+    if after:
+        query = query.where(GPSArchive.day >= after[0].date())
+    if bbox:
+        query = query.where(_archive_overlaps(bbox))
+
+    day = GPSArchive.day.desc() if newest_first else GPSArchive.day
+    archive_ids = db.session.scalars(query.order_by(day)).all()
+
+    for archive_id in archive_ids:
+        data = db.session.scalar(
+            select(GPSArchive.data).where(GPSArchive.id == archive_id)
+        )
+        positions = [
+            pos
+            for pos in unpack_positions(data)
+            if (not start or pos.timestamp >= start)
+            and (not end or pos.timestamp <= end)
+            and (not after or (pos.timestamp, pos.id) > after)
+            and (not bbox or in_bbox(pos.latitude, pos.longitude, bbox))
+        ]
+        yield from reversed(positions) if newest_first else positions
+
+
+def _archive_overlaps(bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    overlaps = and_(
+        GPSArchive.min_latitude <= max_lat, GPSArchive.max_latitude >= min_lat
+    )
+    if min_lon <= max_lon:
+        overlaps = and_(
+            overlaps,
+            GPSArchive.min_longitude <= max_lon,
+            GPSArchive.max_longitude >= min_lon,
+        )
+    # Archives made before bounding boxes were recorded may hold any point
+    return or_(GPSArchive.min_latitude.is_(None), overlaps)
+
+
+def _skip_duplicates(positions):
+    # A point re-inserted after its day was archived is in both tiers; both
+    # copies have the same timestamp, so they arrive next to each other or
+    # separated only by other points with that timestamp
+    timestamp = None
+    sources = set()
+    for pos in positions:
+        if pos.timestamp != timestamp:
+            timestamp = pos.timestamp
+            sources = set()
+        if pos.source in sources:
+            continue
+        sources.add(pos.source)
+        yield pos
+
+
+def iter_positions(user_id, start=None, end=None, bbox=None, after=None, limit=None):
+    """Yield a user's positions from the gps_position table and archived
+    days alike, ordered by (timestamp, id).
+
+    Takes the same filters as tracks.positions_query; ``limit`` caps the
+    number of positions returned. Table rows are fetched in batches, so the
+    positions can be streamed.
+    """
+    query = positions_query(user_id, start, end, bbox, after)
+    if limit:
+        query = query.limit(limit)
+    recent = db.session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+
+    positions = _skip_duplicates(
+        heapq.merge(
+            archived_positions(user_id, start, end, bbox, after),
+            recent,
+            key=position_key,
+        )
+    )
+    return itertools.islice(positions, limit) if limit else positions
+
+
+def cells_query(user_id, start, end, bbox):
+    """positions_query restricted to the grid cells covering ``bbox``,
+    unordered.
+
+    Used for areas of many cells; cell_query reads a few cells faster.
+    """
+    cells = (GPSPosition.cell.between(first, last) for first, last in cell_ranges(bbox))
+    return positions_query(user_id, start, end, bbox).where(or_(*cells)).order_by(None)
+
+
+def cell_query(user_id, cell, start, end, bbox, newest_first=False):
+    """positions_query restricted to one grid cell, oldest or newest first.
+
+    With user_id and cell both compared for equality, databases read the
+    rows in order from the (user_id, cell, timestamp) index.
+    """
+    query = positions_query(user_id, start, end, bbox).where(GPSPosition.cell == cell)
+    if newest_first:
+        query = query.order_by(None).order_by(
+            GPSPosition.timestamp.desc(), GPSPosition.id.desc()
+        )
+    return query
+
+
+def _recent_positions_near(user_id, start, end, bbox, newest_first):
+    # Table rows within bbox in time order, streamed so that callers that
+    # stop early do not load every matching row
+    ranges = cell_ranges(bbox)
+    cells = [cell for first, last in ranges for cell in range(first, last + 1)]
+
+    if len(cells) > NEAR_CELL_QUERIES:
+        # A large area has points at most times, which walking the
+        # (user_id, timestamp) index finds soonest
+        order = (GPSPosition.timestamp, GPSPosition.id)
+        if newest_first:
+            order = (GPSPosition.timestamp.desc(), GPSPosition.id.desc())
+        return db.session.execute(
+            cells_query(user_id, start, end, bbox)
+            .order_by(*order)
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+
+    return heapq.merge(
+        *(
+            db.session.execute(
+                cell_query(
+                    user_id, cell, start, end, bbox, newest_first
+                ).execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            for cell in cells
+        ),
+        key=position_key,
+        reverse=newest_first,
+    )
+
+
+def positions_near(
+    user_id, latitude, longitude, radius, start=None, end=None, newest_first=False
+):
+    """Yield (position, distance) pairs for a user's positions within
+    ``radius`` metres of a point, oldest or newest first.
+
+    Table rows are read in order from the (user_id, cell, timestamp) index,
+    archived days through their bounding boxes, and both only as far as the
+    caller consumes them.
+    """
+    bbox = bbox_around(latitude, longitude, radius)
+    recent = _recent_positions_near(user_id, start, end, bbox, newest_first)
+
+    positions = _skip_duplicates(
+        heapq.merge(
+            archived_positions(user_id, start, end, bbox, newest_first=newest_first),
+            recent,
+            key=position_key,
+            reverse=newest_first,
+        )
+    )
+    for pos in positions:
+        distance = haversine_distance(latitude, longitude, pos.latitude, pos.longitude)
+        if distance <= radius:
+            yield pos, distance
+
+
+def newest_archived_days(user_ids):
+    """Map user ids to the newest day each has archived, or date.min.
+
+    Cached in the archive_day_cache; compact_day drops the entry of its
+    user, and the TTL bounds how long compactions by other processes go
+    unseen.
+    """
+    cache = current_app.extensions["archive_day_cache"]
+    days = {user_id: cache.get(user_id) for user_id in user_ids}
+    missing = [user_id for user_id, day in days.items() if day is None]
+    if missing:
+        newest = dict(
+            db.session.execute(
+                select(GPSArchive.user_id, func.max(GPSArchive.day))
+                .where(GPSArchive.user_id.in_(missing))
+                .group_by(GPSArchive.user_id)
+            ).all()
+        )
+        for user_id in missing:
+            days[user_id] = newest.get(user_id) or date.min
+            cache.set(user_id, days[user_id])
+    return days
+
+
+def skip_archived(rows):
+    """Drop GPSPosition rows whose point is already in an archived day.
+
+    Keeps inserts idempotent once a day has been moved out of the
+    gps_position table, where its unique index no longer sees it. Archives
+    are only looked up for rows no newer than their user's newest archived
+    day, so points logged live cost no lookup.
+    """
+    newest = newest_archived_days({row["user_id"] for row in rows})
+    days = {
+        (row["user_id"], row["timestamp"].date())
+        for row in rows
+        if row["timestamp"].date() <= newest[row["user_id"]]
+    }
+    if not days:
+        return rows
+
+    archives = db.session.execute(
+        select(GPSArchive.user_id, GPSArchive.day, GPSArchive.data).where(
+            GPSArchive.user_id.in_({user_id for user_id, _ in days}),
+            GPSArchive.day.in_({day for _, day in days}),
+        )
+    ).all()
+    if not archives:
+        return rows
+
+    archived = set()
+    for user_id, day, data in archives:
+        if (user_id, day) in days:
+            archived.update(
+                (user_id, pos.timestamp, pos.source) for pos in unpack_positions(data)
+            )
+    return [
+        row
+        for row in rows
+        if (row["user_id"], row["timestamp"], row.get("source")) not in archived
+    ]
+
+
+def compact_day(user_id, day):
+    """Move a user's points for one UTC day into its archive.
+
+    Points already in the archive are kept as they are. Returns the number
+    of rows removed from the gps_position table. The caller is responsible
+    for committing the session.
+    """
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    in_day = (
+        GPSPosition.user_id == user_id,
+        GPSPosition.timestamp >= start,
+        GPSPosition.timestamp < end,
+    )
+
+    rows = db.session.execute(select(*ARCHIVE_COLUMNS).where(*in_day)).all()
+    if not rows:
+        return 0
+
+    archive = GPSArchive.query.filter_by(user_id=user_id, day=day).first()
+    if archive:
+        positions = unpack_positions(archive.data)
+    else:
+        archive = GPSArchive(user_id=user_id, day=day)
+        db.session.add(archive)
+        positions = []
+
+    archived = {(pos.timestamp, pos.source) for pos in positions}
+    positions.extend(
+        ArchivedPosition(*row)
+        for row in rows
+        if (row.timestamp, row.source) not in archived
+    )
+    positions.sort(key=position_key)
+
+    archive.data = pack_positions(positions)
+    archive.point_count = len(positions)
+    archive.first_timestamp = positions[0].timestamp
+    archive.last_timestamp = positions[-1].timestamp
+    archive.min_latitude = min(pos.latitude for pos in positions)
+    archive.max_latitude = max(pos.latitude for pos in positions)
+    archive.min_longitude = min(pos.longitude for pos in positions)
+    archive.max_longitude = max(pos.longitude for pos in positions)
+
+    db.session.execute(delete(GPSPosition).where(*in_day))
+    current_app.extensions["archive_day_cache"].pop(user_id)
+    return len(rows)
+
+
+def days_to_compact(user_id, before):
+    """Yield the UTC days before ``before`` on which a user has points in the
+    gps_position table, oldest first"""
+    after = None
+    while True:
+        query = select(func.min(GPSPosition.timestamp)).where(
+            GPSPosition.user_id == user_id, GPSPosition.timestamp < before
+        )
+        if after:
+            query = query.where(GPSPosition.timestamp >= after)
+
+        first = db.session.scalar(query)
+        if first is None:
+            return
+
+        day = first.date()
+        yield day
+        after = datetime.combine(day + timedelta(days=1), datetime.min.time())
@@ -0,0 +1,307 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import db
+from .archive import cell_query, compact_day, days_to_compact
+from .grid import bbox_around, grid_cell
+from .ingest import (
+    delete_duplicate_positions,
+    insert_positions,
+    refresh_day_summaries,
+)
+from .model import Event, GPSArchive, GPSPosition, User
+from .summaries import rebuild_day_summaries
+from .takeout import LocationHistoryReader, location_rows
+from .tracks import positions_query
+
+
+@click.command("flush-gps-spool")
+def flush_gps_spool():
+    """Insert all GPS points queued in the spool folder."""
+    spool = current_app.extensions.get("gps_spool")
+    if not spool:
+        raise click.ClickException("GPS_INGEST_MODE is not set to 'spool'")
+
+    # Also claims the files left behind by stopped processes
+    if not spool.recover():
+        raise click.ClickException("The GPS spool could not be flushed; see the log")
+    click.echo("GPS spool flushed.")
+
+
+@click.command("dedup-gps")
+def dedup_gps():
+    """Delete duplicate GPS points, keeping the first of each."""
+    deleted = delete_duplicate_positions()
+    db.session.commit()
+    click.echo(f"Deleted {deleted} duplicate GPS points.")
+
+
+def _read_progress(progress_path, size):
+    if not os.path.exists(progress_path):
+        return 0
+
+    with open(progress_path) as f:
+        progress = json.load(f)
+    if progress.get("size") != size:
+        raise click.ClickException(
+            f"{progress_path} was saved for a different file; "
+            "use --restart to import from the beginning"
+        )
+    return progress["offset"]
+
+
+def _write_progress(progress_path, size, offset):
+    # Write a new file and rename it, so a crash never leaves a partial one
+    with open(progress_path + ".tmp", "w") as f:
+        json.dump({"size": size, "offset": offset}, f)
+    os.replace(progress_path + ".tmp", progress_path)
+
+
+@click.command("import-history")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "username", required=True, help="User to import for")
+@click.option("--restart", is_flag=True, help="Ignore any saved progress")
+def import_history(path, username, restart):
+    """Import a Google location history export (Records.json).
+
+    Progress is saved next to the file after every chunk, so an interrupted
+    import continues where it stopped when run again.
+    """
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f"Unknown user: {username}")
+
+    progress_path = path + ".progress"
+    size = os.path.getsize(path)
+    offset = 0 if restart else _read_progress(progress_path, size)
+    if offset:
+        click.echo(f"Resuming at byte {offset:,} of {size:,}.")
+
+    chunk_size = current_app.config["GPX_IMPORT_CHUNK_SIZE"]
+    points_read = 0
+    points_inserted = 0
+
+    try:
+        with open(path, "rb") as f:
+            reader = LocationHistoryReader(f, offset)
+            rows = []
+
+            def save_chunk():
+                nonlocal points_read, points_inserted
+                points_read += len(rows)
+                points_inserted += insert_positions(rows)
+                db.session.commit()
+                # The reader stops right after the last record of the chunk
+                _write_progress(progress_path, size, reader.offset)
+                rows.clear()
+
+            for row in location_rows(reader, user.id):
+                rows.append(row)
+                if len(rows) >= chunk_size:
+                    save_chunk()
+                    click.echo(
+                        f"{reader.offset / size:6.1%}  {points_inserted:,} points imported"
+                    )
+            save_chunk()
+            refresh_day_summaries([user.id])
+            db.session.commit()
+    except ValueError as e:
+        # Progress up to the last complete chunk is kept
+        raise click.ClickException(str(e))
+
+    os.remove(progress_path)
+    click.echo(
+        f"Imported {points_inserted:,} points "
+        f"({points_read - points_inserted:,} duplicates skipped)."
+    )
+
+
+@click.command("rebuild-gps-summaries")
+@click.option("--user", "username", help="Only rebuild this user's summaries")
+def rebuild_gps_summaries(username):
+    """Recompute the daily GPS summaries from the stored points."""
+    users = User.query
+    if username:
+        users = users.filter_by(username=username)
+
+    for user in users.all():
+        rebuild_day_summaries(user)
+        click.echo(f"Rebuilt GPS summaries for {user.username}.")
+
+
+@click.command("refresh-gps-summaries")
+def refresh_gps_summaries():
+    """Add the GPS points logged since the last refresh to the daily summaries.
+
+    The server's job runner refreshes them shortly after points are logged;
+    run this to catch up on points logged while no server was running, or
+    after a refresh failed.
+    """
+    refresh_day_summaries()
+    db.session.commit()
+    click.echo("Refreshed GPS summaries.")
+
+
+@click.command("compact-gps")
+@click.option(
+    "--older-than",
+    "days",
+    type=click.IntRange(min=0),
+    help="Archive days that ended more than this many days ago "
+    "(default GPS_ARCHIVE_AFTER_DAYS)",
+)
+@click.option("--user", "username", help="Only compact this user's points")
+def compact_gps(days, username):
+    """Move old GPS points into compressed per-day archives.
+
+    Each UTC day is committed on its own, so the command can be interrupted
+    and run again.
+    """
+    if days is None:
+        days = current_app.config["GPS_ARCHIVE_AFTER_DAYS"]
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    before = today - timedelta(days=days)
+
+    users = User.query
+    if username:
+        users = users.filter_by(username=username)
+
+    for user in users.all():
+        archived_days = archived_points = 0
+        for day in days_to_compact(user.id, before):
+            archived_points += compact_day(user.id, day)
+            db.session.commit()
+            archived_days += 1
+        click.echo(
+            f"Archived {archived_points:,} GPS points on {archived_days:,} days "
+            f"for {user.username}."
+        )
+
+
+GPS_TIME_INDEXES = (
+    "ix_gps_position_user_id_timestamp",
+    "ix_gps_position_user_id_timestamp_source",
+)
+EVENT_TIME_INDEXES = ("ix_event_user_id_start_time",)
+GPS_CELL_INDEXES = ("ix_gps_position_user_id_cell_timestamp",)
+GPS_ARCHIVE_INDEXES = ("ix_gps_archive_user_id_day",)
+
+
+def _hot_queries():
+    """The per-user time range queries behind the main pages, with the
+    indexes any of which they are expected to use"""
+    end = datetime.utcnow()
+    start = end - timedelta(days=1)
+    day_positions = GPSPosition.between(1, start, end)
+    near_bbox = bbox_around(45, -93, 100)
+    near_cell = grid_cell(45, -93)
+
+    return [
+        ("timeline events", Event.between(1, start, end).statement, EVENT_TIME_INDEXES),
+        (
+            "events page",
+            Event.newest_first(1, before=(end, 1)).limit(1001).statement,
+            EVENT_TIME_INDEXES,
+        ),
+        (
+            "gps_data point count",
+            select(func.count()).select_from(
+                day_positions.order_by(None).statement.subquery()
+            ),
+            GPS_TIME_INDEXES,
+        ),
+        (
+            "add_event nearby points",
+            cell_query(1, near_cell, start, end, near_bbox),
+            GPS_CELL_INDEXES,
+        ),
+        (
+            "gps points near a place",
+            cell_query(1, near_cell, None, None, near_bbox, newest_first=True),
+            GPS_CELL_INDEXES,
+        ),
+        ("gps positions for a day", positions_query(1, start, end), GPS_TIME_INDEXES),
+        (
+            "gps positions page",
+            positions_query(1, start, None, after=(start, 1)).limit(1001),
+            GPS_TIME_INDEXES,
+        ),
+        (
+            "gps archives for a day",
+            select(GPSArchive.id).where(
+                GPSArchive.user_id == 1,
+                GPSArchive.day >= start.date(),
+                GPSArchive.day <= end.date(),
+            ),
+            GPS_ARCHIVE_INDEXES,
+        ),
+    ]
+
+
+def _explain(statement):
+    """Return the database's query plan for ``statement`` as text"""
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    compiled = statement.compile(dialect=connection.dialect)
+
+    # The plan does not depend on the values, only on their types
+    params = {
+        name: value.isoformat(" ") if isinstance(value, datetime) else value
+        for name, value in compiled.params.items()
+    }
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+        if dialect == "postgresql":
+            # Small tables are always scanned; ask what the plan would be
+            # once they are not
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+    rows = connection.exec_driver_sql(prefix + str(compiled), params).all()
+    return "\n".join(" ".join(str(value) for value in row) for row in rows)
+
+
+@click.command("check-query-plans")
+@click.option("--verbose", "-v", is_flag=True, help="Print every query plan")
+def check_query_plans(verbose):
+    """Check that the main time range queries use their indexes.
+
+    Exits with an error if any query plan does not mention an expected index.
+    """
+    failures = []
+    try:
+        for name, statement, indexes in _hot_queries():
+            plan = _explain(statement)
+            used = any(index in plan for index in indexes)
+            click.echo(f"{'ok' if used else 'FAIL':<4} {name}")
+            if verbose or not used:
+                click.echo("     " + plan.replace("\n", "\n     "))
+            if not used:
+                failures.append(name)
+    finally:
+        db.session.rollback()
+
+    if failures:
+        raise click.ClickException(
+            f"{len(failures)} queries do not use their index: {', '.join(failures)}"
+        )
+
+
+cli_commands = [
+    flush_gps_spool,
+    dedup_gps,
+    import_history,
+    rebuild_gps_summaries,
+    refresh_gps_summaries,
+    compact_gps,
+    check_query_plans,
+]
@@ -13,11 +13,111 @@ class Config:
     PROTOMAPS_API_KEY = os.environ.get("PROTOMAPS_API_KEY")
     # Other common configuration
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    # GPX files are streamed into the database, so allow much larger imports
+    GPX_IMPORT_MAX_CONTENT_LENGTH = int(
+        os.environ.get("GPX_IMPORT_MAX_CONTENT_LENGTH", 1024 * 1024 * 1024)
+    )
+    # Background import jobs: worker threads, and seconds to keep finished jobs
+    IMPORT_JOB_WORKERS = int(os.environ.get("IMPORT_JOB_WORKERS", 2))
+    IMPORT_JOB_RETENTION = int(os.environ.get("IMPORT_JOB_RETENTION", 3600))
+    # Worker processes used to parse the files of multi-file GPX imports
+    GPX_PARSE_WORKERS = int(os.environ.get("GPX_PARSE_WORKERS", os.cpu_count() or 1))
+    # Number of imported points sent to the database in each INSERT
+    GPX_IMPORT_CHUNK_SIZE = int(os.environ.get("GPX_IMPORT_CHUNK_SIZE", 1000))
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER") or os.path.join(
         os.getcwd(), "uploads"
     )
+    # Maximum number of points accepted by a single batch GPS upload
+    GPS_BATCH_MAX_POINTS = int(os.environ.get("GPS_BATCH_MAX_POINTS", 10000))
+    # In-process cache of validated API keys
+    API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", 1024))
+    API_KEY_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", 300))
+    # Minimum number of seconds between writes to an API key's last_used
+    API_KEY_LAST_USED_INTERVAL = int(os.environ.get("API_KEY_LAST_USED_INTERVAL", 60))
+    # Largest page of positions returned by /api/gps/positions range queries
+    GPS_PAGE_SIZE = int(os.environ.get("GPS_PAGE_SIZE", 10000))
+    # Largest page of events returned by /api/events
+    EVENT_PAGE_SIZE = int(os.environ.get("EVENT_PAGE_SIZE", 1000))
+    # In-process cache of simplified tracks for /api/gps/positions
+    TRACK_CACHE_SIZE = int(os.environ.get("TRACK_CACHE_SIZE", 256))
+    TRACK_CACHE_TTL = int(os.environ.get("TRACK_CACHE_TTL", 3600))
+    # Distance in metres within which add_event looks for the GPS point it
+    # takes the event's start time from
+    NEARBY_POINT_RADIUS = float(os.environ.get("NEARBY_POINT_RADIUS", 100))
+    # Largest radius in metres accepted by /api/gps/near
+    GPS_NEAR_MAX_RADIUS = float(os.environ.get("GPS_NEAR_MAX_RADIUS", 50000))
+    # Stay detection for /api/events/suggestions: a stay is at least
+    # STAY_MIN_DURATION seconds within STAY_RADIUS metres; stays at the same
+    # place less than STAY_MERGE_GAP seconds apart are joined, and named
+    # after a saved location within STAY_LOCATION_RADIUS metres
+    STAY_RADIUS = float(os.environ.get("STAY_RADIUS", 100))
+    STAY_MIN_DURATION = int(os.environ.get("STAY_MIN_DURATION", 600))
+    STAY_MERGE_GAP = int(os.environ.get("STAY_MERGE_GAP", 600))
+    STAY_LOCATION_RADIUS = float(os.environ.get("STAY_LOCATION_RADIUS", 150))
+    # Longest start to end range in days accepted by /api/events/suggestions,
+    # which loads every point of the range into memory
+    EVENT_SUGGESTION_MAX_DAYS = int(os.environ.get("EVENT_SUGGESTION_MAX_DAYS", 31))
+    # Trip segmentation for /api/gps/trips and travel events: trips are split
+    # where no point was recorded for TRIP_MAX_GAP seconds or the track jumps
+    # TRIP_MAX_JUMP metres, and trips under TRIP_MIN_DISTANCE metres dropped
+    TRIP_MAX_GAP = int(os.environ.get("TRIP_MAX_GAP", 900))
+    TRIP_MAX_JUMP = float(os.environ.get("TRIP_MAX_JUMP", 2000))
+    TRIP_MIN_DISTANCE = float(os.environ.get("TRIP_MIN_DISTANCE", 200))
+    # In-process cache of the trips of each day
+    TRIP_CACHE_SIZE = int(os.environ.get("TRIP_CACHE_SIZE", 256))
+    TRIP_CACHE_TTL = int(os.environ.get("TRIP_CACHE_TTL", 3600))
+    # In-process cache of each user's saved location index; entries are
+    # dropped when this process changes a location, the TTL bounds how long
+    # changes made by other processes go unseen
+    LOCATION_INDEX_CACHE_SIZE = int(os.environ.get("LOCATION_INDEX_CACHE_SIZE", 256))
+    LOCATION_INDEX_CACHE_TTL = int(os.environ.get("LOCATION_INDEX_CACHE_TTL", 300))
+    # Days of GPS points kept in the gps_position table by `flask compact-gps`;
+    # older days are packed into gps_archive
+    GPS_ARCHIVE_AFTER_DAYS = int(os.environ.get("GPS_ARCHIVE_AFTER_DAYS", 90))
+    # In-process cache of each user's newest archived day, which GPS inserts
+    # check before looking for archived duplicates; the TTL bounds how long
+    # days archived by other processes go unchecked
+    ARCHIVE_DAY_CACHE_SIZE = int(os.environ.get("ARCHIVE_DAY_CACHE_SIZE", 1024))
+    ARCHIVE_DAY_CACHE_TTL = int(os.environ.get("ARCHIVE_DAY_CACHE_TTL", 300))
+    # GPS ingest mode for /api/gps/log: "sync" commits every point before
+    # responding, "spool" queues points in a local spool file and commits them
+    # in groups from a background thread
+    GPS_INGEST_MODE = os.environ.get("GPS_INGEST_MODE", "sync")
+    GPS_SPOOL_FOLDER = os.environ.get("GPS_SPOOL_FOLDER")
+    GPS_SPOOL_BATCH_SIZE = int(os.environ.get("GPS_SPOOL_BATCH_SIZE", 500))
+    GPS_SPOOL_FLUSH_INTERVAL = float(os.environ.get("GPS_SPOOL_FLUSH_INTERVAL", 2.0))
+    GPS_SPOOL_FSYNC = os.environ.get("GPS_SPOOL_FSYNC", "true").lower() == "true"
+    # Distance in metres within which checkin lists places
+    CHECKIN_RADIUS = float(os.environ.get("CHECKIN_RADIUS", 500))
     # Foursquare API key
     FOURSQUARE_API_KEY = os.environ.get("FOURSQUARE_API_KEY", "")
+    FOURSQUARE_API_URL = os.environ.get(
+        "FOURSQUARE_API_URL", "https://api.foursquare.com/v3/places/search"
+    )
+    # Venue searches saved in a SQLite file shared by all workers, by default
+    # foursquare_cache.sqlite in the instance folder
+    FOURSQUARE_CACHE_PATH = os.environ.get("FOURSQUARE_CACHE_PATH")
+    FOURSQUARE_CACHE_TTL = int(os.environ.get("FOURSQUARE_CACHE_TTL", 7 * 86400))
+    FOURSQUARE_CACHE_SIZE = int(os.environ.get("FOURSQUARE_CACHE_SIZE", 10000))
+    # Metres searched beyond the radius asked for, so that a saved search
+    # also covers check-ins from nearby
+    FOURSQUARE_CACHE_MARGIN = float(os.environ.get("FOURSQUARE_CACHE_MARGIN", 250))
+    # Foursquare requests: seconds to connect and to wait for a response,
+    # retries of failed connections and 429/5xx responses, and pooled
+    # keep-alive connections per worker
+    FOURSQUARE_CONNECT_TIMEOUT = float(
+        os.environ.get("FOURSQUARE_CONNECT_TIMEOUT", 3.05)
+    )
+    FOURSQUARE_READ_TIMEOUT = float(os.environ.get("FOURSQUARE_READ_TIMEOUT", 4))
+    FOURSQUARE_RETRIES = int(os.environ.get("FOURSQUARE_RETRIES", 2))
+    FOURSQUARE_RETRY_BACKOFF = float(os.environ.get("FOURSQUARE_RETRY_BACKOFF", 0.2))
+    FOURSQUARE_POOL_SIZE = int(os.environ.get("FOURSQUARE_POOL_SIZE", 10))
+    # After FOURSQUARE_BREAKER_THRESHOLD failed searches in a row, checkin
+    # stops calling Foursquare for FOURSQUARE_BREAKER_RESET seconds
+    FOURSQUARE_BREAKER_THRESHOLD = int(
+        os.environ.get("FOURSQUARE_BREAKER_THRESHOLD", 5)
+    )
+    FOURSQUARE_BREAKER_RESET = float(os.environ.get("FOURSQUARE_BREAKER_RESET", 60))
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,101 @@
+import xml.etree.ElementTree as ET
+
+from .ingest import import_positions, parse_timestamp
+
+# GPSPosition.source of points imported from GPX files
+GPX_SOURCE = "gpx_import"
+
+
+def _local_name(tag):
+    # Strip the namespace so GPX 1.0, 1.1 and extension elements all match
+    return tag.rsplit("}", 1)[-1]
+
+
+def _read_track_point(element):
+    timestamp = elevation = speed = None
+    for child in element.iter():
+        name = _local_name(child.tag)
+        # Empty elements, such as <time/>, count as missing
+        text = (child.text or "").strip()
+        if not text:
+            continue
+        if name == "time":
+            timestamp = parse_timestamp(text)
+        elif name == "ele":
+            elevation = float(text)
+        elif name == "speed":
+            speed = float(text)
+
+    return (
+        timestamp,
+        float(element.get("lat")),
+        float(element.get("lon")),
+        elevation,
+        speed,
+    )
+
+
+def iter_gpx_points(stream):
+    """Yield (timestamp, latitude, longitude, elevation, speed) for each trkpt.
+
+    The document is parsed incrementally and every track point is discarded
+    once read, so memory use does not grow with the size of the file. Points
+    without a timestamp are skipped.
+    """
+    parents = []
+    for event, element in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if _local_name(element.tag) != "trkpt":
+            continue
+
+        point = _read_track_point(element)
+
+        # The point is the last child of its segment, so drop it from the tree
+        if parents:
+            del parents[-1][-1]
+
+        if point[0] is not None:
+            yield point
+
+
+def iter_gpx_file(path):
+    """Yield the track points of the GPX file at ``path``"""
+    with open(path, "rb") as file:
+        yield from iter_gpx_points(file)
+
+
+def parse_gpx_file(path):
+    """Return the track points of a GPX file as a list.
+
+    Used by worker processes, which send the parsed points back to a single
+    writer in the parent.
+    """
+    return list(iter_gpx_file(path))
+
+
+def gpx_rows(points, user_id):
+    """Turn (timestamp, latitude, longitude, elevation, speed) tuples into
+    GPSPosition rows"""
+    for timestamp, latitude, longitude, elevation, speed in points:
+        yield {
+            "user_id": user_id,
+            "timestamp": timestamp,
+            "latitude": latitude,
+            "longitude": longitude,
+            "altitude": elevation,
+            "speed": speed,
+            "source": GPX_SOURCE,
+        }
+
+
+def import_gpx_stream(stream, user_id, chunk_size):
+    """Insert the track points of a GPX document in chunks of ``chunk_size``.
+
+    Returns a (points_read, points_inserted) tuple. The caller is responsible
+    for committing the session.
+    """
+    return import_positions(gpx_rows(iter_gpx_points(stream), user_id), chunk_size)
@@ -0,0 +1,73 @@
+import math
+
+# Size in degrees of the cells that GPSPosition.cell numbers; about 1.1 km
+# north to south
+CELL_SIZE = 0.01
+GRID_COLUMNS = round(360 / CELL_SIZE)
+
+EARTH_RADIUS = 6371000  # metres
+
+
+def _row(latitude):
+    return math.floor((latitude + 90) / CELL_SIZE)
+
+
+def _column(longitude):
+    # 180 and -180 are the same meridian
+    return math.floor((longitude + 180) / CELL_SIZE) % GRID_COLUMNS
+
+
+def grid_cell(latitude, longitude):
+    """The number of the grid cell containing a point.
+
+    Cells are numbered row by row from the south pole, so the cells of a row
+    between two longitudes form a single range of numbers.
+    """
+    return _row(latitude) * GRID_COLUMNS + _column(longitude)
+
+
+def bbox_around(latitude, longitude, radius):
+    """The (min_lon, min_lat, max_lon, max_lat) box containing every point
+    within ``radius`` metres of a point.
+
+    The box crosses the antimeridian when min_lon > max_lon, as in
+    tracks.positions_query.
+    """
+    angle = radius / EARTH_RADIUS
+    delta_lat = math.degrees(angle)
+    min_lat = max(latitude - delta_lat, -90)
+    max_lat = min(latitude + delta_lat, 90)
+
+    # Meridians converge, so the box is wider in degrees away from the
+    # equator; around a pole it takes in every longitude
+    if (
+        min_lat == -90
+        or max_lat == 90
+        or math.sin(angle) >= math.cos(math.radians(latitude))
+    ):
+        return -180, min_lat, 180, max_lat
+
+    delta_lon = math.degrees(
+        math.asin(math.sin(angle) / math.cos(math.radians(latitude)))
+    )
+    min_lon = (longitude - delta_lon + 180) % 360 - 180
+    max_lon = (longitude + delta_lon + 180) % 360 - 180
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def cell_ranges(bbox):
+    """The (first, last) ranges of cell numbers covering a bbox"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon == -180 and max_lon == 180:
+        columns = [(0, GRID_COLUMNS - 1)]
+    elif min_lon <= max_lon:
+        columns = [(_column(min_lon), _column(max_lon))]
+    else:
+        # The box crosses the antimeridian
+        columns = [(_column(min_lon), GRID_COLUMNS - 1), (0, _column(max_lon))]
+
+    return [
+        (row * GRID_COLUMNS + first, row * GRID_COLUMNS + last)
+        for row in range(_row(min_lat), _row(max_lat) + 1)
+        for first, last in columns
+    ]
@@ -0,0 +1,334 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .archive import iter_positions, skip_archived
+from .model import GPSDaySummary, GPSPendingRange, GPSPosition, User
+from .summaries import (
+    day_bounds,
+    extend_summary,
+    local_day,
+    summarize_day,
+    user_timezones,
+)
+
+# Content types accepted by the batch ingest endpoint
+JSON_CONTENT_TYPES = ("application/json",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+CSV_CONTENT_TYPES = ("text/csv",)
+
+# Pending ranges deleted per statement, below the bound parameter limits
+PENDING_DELETE_BATCH_SIZE = 1000
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime"""
+    if not value:
+        raise ValueError("Missing timestamp")
+
+    timestamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(pytz.UTC).replace(tzinfo=None)
+    return timestamp
+
+
+def _get_float(values, name):
+    value = values.get(name)
+    if value is None or value == "":
+        return None
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {name}: {value!r}")
+
+
+def parse_gps_point(values, user_id, source):
+    """Validate a GPSLogger-style point and return a row for GPSPosition.
+
+    ``values`` is any mapping using the GPSLogger parameter names (lat, lon,
+    time, alt, acc, spd, dir, prov). Raises ValueError if the point is invalid.
+    """
+    latitude = _get_float(values, "lat")
+    longitude = _get_float(values, "lon")
+    timestamp_str = values.get("time")
+
+    if latitude is None or longitude is None or not timestamp_str:
+        raise ValueError("Missing required parameters")
+
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError(f"Coordinates out of range: {latitude}, {longitude}")
+
+    altitude = _get_float(values, "alt")
+    accuracy = _get_float(values, "acc")
+    speed = _get_float(values, "spd")
+    bearing = _get_float(values, "dir")
+    provider = values.get("prov")
+
+    return {
+        "user_id": user_id,
+        "timestamp": parse_timestamp(timestamp_str),
+        "latitude": latitude,
+        "longitude": longitude,
+        "altitude": altitude if altitude else None,
+        "accuracy": accuracy if accuracy else None,
+        "speed": speed if speed else None,
+        "bearing": bearing if bearing else None,
+        "provider": str(provider) if provider is not None else None,
+        "source": source,
+    }
+
+
+def read_gps_batch(request):
+    """Read the points of a batch upload from the request body.
+
+    Returns a list where each entry is either a mapping of GPSLogger
+    parameters or an Exception describing why that entry could not be read.
+    Raises ValueError if the body as a whole cannot be understood.
+    """
+    content_type = request.mimetype
+
+    if content_type in JSON_CONTENT_TYPES:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get("points")
+        if not isinstance(data, list):
+            raise ValueError("Expected a JSON array of points")
+        return [
+            point if isinstance(point, dict) else ValueError("Expected an object")
+            for point in data
+        ]
+
+    body = request.get_data(as_text=True)
+
+    if content_type in NDJSON_CONTENT_TYPES:
+        points = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                point = json.loads(line)
+            except ValueError as e:
+                points.append(ValueError(f"Invalid JSON: {e}"))
+                continue
+            if not isinstance(point, dict):
+                point = ValueError("Expected an object")
+            points.append(point)
+        return points
+
+    if content_type in CSV_CONTENT_TYPES:
+        return list(csv.DictReader(io.StringIO(body)))
+
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def _insert_ignore(table):
+    """Build an INSERT that skips rows violating a unique constraint"""
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        return postgresql_insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    return insert(table)
+
+
+def insert_positions(rows):
+    """Insert GPSPosition rows with a single multi-row INSERT.
+
+    Rows that already exist for the same (user_id, timestamp, source) are
+    skipped, so retried uploads and re-imported files are idempotent, even
+    once their day has been archived. The time ranges of the inserted rows
+    are queued for refresh_day_summaries. Returns the number of rows
+    actually inserted. The caller is responsible for committing the session.
+    """
+    if rows:
+        rows = skip_archived(rows)
+    if not rows:
+        return 0
+
+    table = GPSPosition.__table__
+    statement = _insert_ignore(table)
+
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        # Only the rows that were not skipped are returned
+        inserted = (
+            db.session.execute(
+                statement.returning(table.c.user_id, table.c.timestamp), rows
+            )
+            .mappings()
+            .all()
+        )
+        queue_pending_ranges(inserted)
+        return len(inserted)
+
+    result = db.session.execute(statement, rows)
+    inserted = result.rowcount if result.rowcount >= 0 else len(rows)
+    if inserted:
+        # Skipped rows are queued too; refreshing finds nothing new for them
+        queue_pending_ranges(rows)
+    return inserted
+
+
+def queue_pending_ranges(rows):
+    """Queue the time ranges of newly inserted GPSPosition rows, one per user
+    and UTC day, to be added to their day summaries"""
+    ranges = {}
+    for row in rows:
+        key = (row["user_id"], row["timestamp"].date())
+        first, last = ranges.get(key, (row["timestamp"], row["timestamp"]))
+        ranges[key] = (min(first, row["timestamp"]), max(last, row["timestamp"]))
+
+    if ranges:
+        db.session.execute(
+            insert(GPSPendingRange.__table__),
+            [
+                {"user_id": user_id, "first_timestamp": first, "last_timestamp": last}
+                for (user_id, _), (first, last) in ranges.items()
+            ],
+        )
+
+
+def refresh_day_summaries(user_ids=None):
+    """Add the points of the queued pending ranges to their day summaries.
+
+    Only the ranges of ``user_ids`` are refreshed when it is given. Points
+    that extend a day at either end are read and added to its summary; a
+    day that gained points in between, or is new, is recomputed from its
+    points. Either way each day is read once however many ranges were
+    queued for it. Users whose summaries are being rebuilt are skipped until
+    the rebuild finishes. The caller is responsible for committing the
+    session.
+    """
+    query = (
+        select(
+            GPSPendingRange.id,
+            GPSPendingRange.user_id,
+            GPSPendingRange.first_timestamp,
+            GPSPendingRange.last_timestamp,
+        )
+        .join(User, User.id == GPSPendingRange.user_id)
+        .where(User.summaries_complete_before.is_(None))
+    )
+    if user_ids is not None:
+        query = query.where(GPSPendingRange.user_id.in_(user_ids))
+    # Locked so that concurrent refreshes do not add the same points twice
+    ranges = db.session.execute(query.with_for_update(of=GPSPendingRange)).all()
+    if not ranges:
+        return
+
+    # The pending ranges of each day, clipped to the day
+    timezones = user_timezones({user_id for _, user_id, _, _ in ranges})
+    days = defaultdict(list)
+    for _, user_id, first, last in ranges:
+        tz = timezones[user_id]
+        day = local_day(first, tz)
+        while day <= local_day(last, tz):
+            start, end = day_bounds(day, tz)
+            days[user_id, day].append(
+                (max(first, start), min(last, end - timedelta(microseconds=1)))
+            )
+            day += timedelta(days=1)
+
+    # Create missing summaries without failing when another request has just
+    # created the same one
+    db.session.execute(
+        _insert_ignore(GPSDaySummary.__table__),
+        [
+            {"user_id": user_id, "day": day, "point_count": 0, "distance": 0}
+            for user_id, day in days
+        ],
+    )
+
+    for (user_id, day), times in days.items():
+        summary = db.session.execute(
+            select(GPSDaySummary)
+            .where(GPSDaySummary.user_id == user_id, GPSDaySummary.day == day)
+            .with_for_update()
+        ).scalar_one()
+        _refresh_summary(summary, times, timezones[user_id])
+
+    range_ids = [range_id for range_id, _, _, _ in ranges]
+    for offset in range(0, len(range_ids), PENDING_DELETE_BATCH_SIZE):
+        db.session.execute(
+            delete(GPSPendingRange).where(
+                GPSPendingRange.id.in_(
+                    range_ids[offset : offset + PENDING_DELETE_BATCH_SIZE]
+                )
+            )
+        )
+
+
+def _refresh_summary(summary, times, tz):
+    # Only the new points are read when they all come after, or all before,
+    # the points already summarized
+    start, end = day_bounds(summary.day, tz)
+    if not summary.point_count:
+        points = None
+    elif min(first for first, _ in times) > summary.last_timestamp:
+        points = iter_positions(
+            summary.user_id,
+            summary.last_timestamp + timedelta(microseconds=1),
+            end - timedelta(microseconds=1),
+        )
+    elif max(last for _, last in times) < summary.first_timestamp:
+        points = iter_positions(
+            summary.user_id, start, summary.first_timestamp - timedelta(microseconds=1)
+        )
+    else:
+        points = None
+
+    if points is None or not extend_summary(
+        summary,
+        [(pos.timestamp, pos.latitude, pos.longitude, pos.speed) for pos in points],
+    ):
+        summarize_day(summary, tz)
+
+
+def import_positions(rows, chunk_size):
+    """Insert an iterable of GPSPosition rows in chunks of ``chunk_size``.
+
+    Returns a (rows_read, rows_inserted) tuple. The caller is responsible for
+    committing the session.
+    """
+    rows_read = 0
+    rows_inserted = 0
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            rows_read += len(chunk)
+            rows_inserted += insert_positions(chunk)
+            chunk = []
+
+    rows_read += len(chunk)
+    rows_inserted += insert_positions(chunk)
+    return rows_read, rows_inserted
+
+
+def delete_duplicate_positions():
+    """Delete all but the first of each (user_id, timestamp, source) row.
+
+    Returns the number of rows deleted. The caller is responsible for
+    committing the session.
+    """
+    keep = (
+        select(func.min(GPSPosition.id).label("id"))
+        .group_by(GPSPosition.user_id, GPSPosition.timestamp, GPSPosition.source)
+        .subquery()
+    )
+    result = db.session.execute(
+        delete(GPSPosition).where(GPSPosition.id.not_in(select(keep.c.id)))
+    )
+    return result.rowcount
@@ -0,0 +1,382 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .gpx import GPX_SOURCE, gpx_rows, iter_gpx_file, parse_gpx_file
+from .ingest import import_positions, refresh_day_summaries
+from .model import ImportLedger, User
+from .summaries import rebuild_day_summaries
+from .takeout import TAKEOUT_SOURCE, iter_location_history_file
+
+# Upload file extensions the import job knows how to read
+IMPORT_FILE_EXTENSIONS = (".gpx", ".json")
+
+
+class ImportJob:
+    """Progress of importing a set of uploaded files for one user"""
+
+    def __init__(self, user_id, files):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        # List of (original filename, path of the staged copy, content hash)
+        self.files = files
+        self.status = "queued"
+        self.files_done = 0
+        self.files_skipped = 0
+        self.points_read = 0
+        self.points_inserted = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def points_per_second(self):
+        if not self.started_at:
+            return 0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.points_read / elapsed if elapsed > 0 else 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "files_total": len(self.files),
+            "files_done": self.files_done,
+            "files_skipped": self.files_skipped,
+            "points_inserted": self.points_inserted,
+            "duplicates": self.points_read - self.points_inserted,
+            "errors": self.errors,
+            "points_per_second": round(self.points_per_second, 1),
+        }
+
+
+class JobRunner:
+    """Runs import jobs on a local thread pool and keeps track of their progress.
+
+    When a job has several GPX files and GPX_PARSE_WORKERS is above one, the
+    files are parsed on a shared process pool and inserted by the job thread.
+    Location history exports (.json) are streamed in the job thread.
+
+    Jobs live in the memory of the process that accepted the upload and are
+    forgotten IMPORT_JOB_RETENTION seconds after they finish.
+
+    The runner also keeps day summaries current off the request path: it
+    refreshes them after points are logged, and rebuilds those of users
+    whose timezone changed, which reads their whole history. Both run on one
+    thread of their own, so they never work on the same summaries at once
+    or wait behind imports.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.retention = app.config["IMPORT_JOB_RETENTION"]
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config["IMPORT_JOB_WORKERS"],
+            thread_name_prefix="import-job",
+        )
+        self.parse_workers = app.config["GPX_PARSE_WORKERS"]
+        self._process_pool = None
+        self._summary_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="gps-summaries"
+        )
+        self._jobs = {}
+        # The timezone each user's queued or running rebuild is heading for
+        self._rebuilds = {}
+        # Users whose summaries are waiting for a refresh, and whether one is
+        # queued or running
+        self._refreshes = set()
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def rebuild_summaries(self, user_id, timezone):
+        """Rebuild a user's day summaries in ``timezone`` in the background.
+
+        The days not rebuilt yet are marked by
+        user.summaries_complete_before. A timezone given while a rebuild is
+        running replaces the one it is heading for, so the user ends up in
+        the latest.
+        """
+        with self._lock:
+            running = user_id in self._rebuilds
+            self._rebuilds[user_id] = timezone
+        if not running:
+            self._summary_executor.submit(self._rebuild_summaries, user_id)
+
+    def refresh_summaries(self, user_ids):
+        """Add the points logged or imported for users to their day summaries
+        in the background.
+
+        Users asked for while a refresh is queued or running are refreshed
+        together by the next one.
+        """
+        with self._lock:
+            self._refreshes.update(user_ids)
+            if self._refreshing:
+                return
+            self._refreshing = True
+        self._summary_executor.submit(self._refresh_summaries)
+
+    def _refresh_summaries(self):
+        with self.app.app_context():
+            while True:
+                with self._lock:
+                    user_ids, self._refreshes = self._refreshes, set()
+                    if not user_ids:
+                        self._refreshing = False
+                        return
+
+                try:
+                    refresh_day_summaries(user_ids)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception(
+                        "Error refreshing GPS summaries of users %s", sorted(user_ids)
+                    )
+
+    def _rebuild_summaries(self, user_id):
+        with self.app.app_context():
+            while True:
+                with self._lock:
+                    timezone = self._rebuilds[user_id]
+
+                try:
+                    user = db.session.get(User, user_id)
+                    if user.timezone != timezone:
+                        rebuild_day_summaries(user, timezone)
+                except Exception:
+                    # The days rebuilt so far are kept; the rest are read from
+                    # their points until flask rebuild-gps-summaries is run
+                    db.session.rollback()
+                    self.app.logger.exception(
+                        "Error rebuilding GPS summaries of user %s", user_id
+                    )
+
+                with self._lock:
+                    if self._rebuilds[user_id] == timezone:
+                        del self._rebuilds[user_id]
+                        return
+
+    def _prune(self):
+        expired_before = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and job.finished_at < expired_before:
+                del self._jobs[job_id]
+
+    def _get_process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                # Spawn rather than fork, since this process is multi-threaded
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._process_pool
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+
+        try:
+            with self.app.app_context():
+                files = self._skip_imported_files(job)
+                gpx_files = [f for f in files if _is_gpx(f[0])]
+                history_files = [f for f in files if not _is_gpx(f[0])]
+
+                if self.parse_workers > 1 and len(gpx_files) > 1:
+                    self._run_parallel(job, gpx_files)
+                else:
+                    self._run_sequential(job, gpx_files)
+
+                for staged_file in history_files:
+                    path = staged_file[1]
+                    self._import_file(
+                        job,
+                        staged_file,
+                        TAKEOUT_SOURCE,
+                        lambda: iter_location_history_file(path, job.user_id),
+                    )
+        finally:
+            self.refresh_summaries([job.user_id])
+            job.finished_at = time.time()
+            job.status = "finished"
+
+    def _skip_imported_files(self, job):
+        # Files whose exact contents were imported before are not parsed again
+        imported_hashes = set(
+            db.session.scalars(
+                select(ImportLedger.content_hash).where(
+                    ImportLedger.user_id == job.user_id,
+                    ImportLedger.content_hash.in_(
+                        [content_hash for _, _, content_hash in job.files]
+                    ),
+                )
+            )
+        )
+
+        files = []
+        for filename, path, content_hash in job.files:
+            if content_hash in imported_hashes:
+                os.remove(path)
+                job.files_skipped += 1
+                job.files_done += 1
+            else:
+                imported_hashes.add(content_hash)
+                files.append((filename, path, content_hash))
+        return files
+
+    def _run_sequential(self, job, files):
+        for staged_file in files:
+            path = staged_file[1]
+            self._import_file(
+                job,
+                staged_file,
+                GPX_SOURCE,
+                lambda: gpx_rows(iter_gpx_file(path), job.user_id),
+            )
+
+    def _run_parallel(self, job, files):
+        # Parse files in worker processes while this thread inserts the points
+        # of each file as it arrives. Only a few files are parsed ahead so the
+        # parsed points waiting for the writer stay bounded.
+        pool = self._get_process_pool()
+        files = iter(files)
+        pending = {}
+        # A file taken from ``files`` that the pool has not accepted yet
+        unsubmitted = []
+
+        def submit_next():
+            next_file = next(files, None)
+            if next_file:
+                unsubmitted.append(next_file)
+                pending[pool.submit(parse_gpx_file, next_file[1])] = next_file
+                unsubmitted.clear()
+
+        try:
+            for _ in range(self.parse_workers * 2):
+                submit_next()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # Still pending until imported, so it is parsed again if
+                    # the pool breaks
+                    self._import_file(
+                        job,
+                        pending[future],
+                        GPX_SOURCE,
+                        lambda: gpx_rows(future.result(), job.user_id),
+                    )
+                    del pending[future]
+                    submit_next()
+
+        except BrokenProcessPool:
+            # A worker process died; start a new pool for the next job and
+            # parse the files that were not handed out yet in this thread
+            self.app.logger.exception("GPX parsing process pool failed")
+            with self._lock:
+                self._process_pool = None
+            self._run_sequential(job, [*unsubmitted, *pending.values(), *files])
+
+    def _import_file(self, job, staged_file, source, read_rows):
+        filename, path, content_hash = staged_file
+        ledger = ImportLedger(
+            user_id=job.user_id,
+            content_hash=content_hash,
+            filename=filename,
+            source=source,
+        )
+
+        retried = False
+
+        def counted_rows():
+            # Points imported before are skipped by the unique index, so
+            # every row is passed on
+            for row in read_rows():
+                timestamp = row["timestamp"]
+                ledger.point_count += 1
+                if not ledger.first_timestamp or timestamp < ledger.first_timestamp:
+                    ledger.first_timestamp = timestamp
+                if not ledger.last_timestamp or timestamp > ledger.last_timestamp:
+                    ledger.last_timestamp = timestamp
+                yield row
+
+        try:
+            ledger.point_count = 0
+            _, points_inserted = import_positions(
+                counted_rows(), self.app.config["GPX_IMPORT_CHUNK_SIZE"]
+            )
+            db.session.add(ledger)
+            db.session.commit()
+            job.points_read += ledger.point_count
+            job.points_inserted += points_inserted
+
+        except BrokenProcessPool:
+            # The caller parses the file again, so keep its staged copy
+            db.session.rollback()
+            retried = True
+            raise
+
+        except IntegrityError:
+            # The same file was imported by another job in the meantime
+            db.session.rollback()
+            job.files_skipped += 1
+
+        except Exception as e:
+            db.session.rollback()  # Rollback changes for the current file if an error occurs
+            job.errors.append(f"Error processing file {filename}: {str(e)}")
+
+        finally:
+            if not retried:
+                # Remove the staged copy after processing
+                if os.path.exists(path):
+                    os.remove(path)
+                job.files_done += 1
+
+
+def _is_gpx(filename):
+    return filename.lower().endswith(".gpx")
+
+
+def stage_upload(file, folder):
+    """Copy an uploaded file into ``folder``.
+
+    Returns the path of the copy and the SHA-256 hex digest of its contents.
+    """
+    os.makedirs(folder, exist_ok=True)
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(
+        dir=folder, suffix=os.path.splitext(file.filename)[1], delete=False
+    ) as staged:
+        for block in iter(lambda: file.stream.read(64 * 1024), b""):
+            content_hash.update(block)
+            staged.write(block)
+    return staged.name, content_hash.hexdigest()
@@ -5,6 +5,7 @@ from datetime import datetime
 from flask_login import UserMixin
 
 from . import db
+from .grid import grid_cell
 
 
 class User(db.Model, UserMixin):
@@ -12,6 +13,13 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128))
+    # Timezone that GPS day summaries are kept in; updated from the browser
+    timezone = db.Column(
+        db.String(50), nullable=False, default="UTC", server_default="UTC"
+    )
+    # While summaries.rebuild_day_summaries runs, the first day whose summary
+    # has not been rebuilt yet; None once every day is summarized
+    summaries_complete_before = db.Column(db.Date)
     events = db.relationship("Event", backref="user", lazy=True)
 
 
@@ -49,6 +57,50 @@ class Event(db.Model):
         "EventAttribute", backref="event", lazy=True, cascade="all, delete-orphan"
     )
 
+    __table_args__ = (db.Index("ix_event_user_id_start_time", "user_id", "start_time"),)
+
+    @classmethod
+    def between(cls, user_id, start, end):
+        """Query a user's events starting between two datetimes, oldest first"""
+        return cls.query.filter(
+            cls.user_id == user_id,
+            cls.start_time >= start,
+            cls.start_time <= end,
+        ).order_by(cls.start_time)
+
+    @classmethod
+    def newest_first(
+        cls,
+        user_id,
+        start=None,
+        end=None,
+        event_types=None,
+        location_id=None,
+        before=None,
+    ):
+        """Query a user's events, newest first, optionally filtered.
+
+        Events are ordered on (start_time, id); ``before`` is the key of the
+        last event of the previous page.
+        """
+        query = cls.query.filter(cls.user_id == user_id)
+        if start:
+            query = query.filter(cls.start_time >= start)
+        if end:
+            query = query.filter(cls.start_time <= end)
+        if event_types:
+            query = query.filter(cls.event_type.in_(event_types))
+        if location_id is not None:
+            query = query.filter(cls.location_id == location_id)
+        if before:
+            before_time, before_id = before
+            # The first condition alone can use the (user_id, start_time) index
+            query = query.filter(
+                cls.start_time <= before_time,
+                db.or_(cls.start_time < before_time, cls.id < before_id),
+            )
+        return query.order_by(cls.start_time.desc(), cls.id.desc())
+
     def add_attribute(self, key, value):
         attr = EventAttribute(key=key, value=json.dumps(value), event_id=self.id)
         db.session.add(attr)
@@ -59,6 +111,12 @@ class Event(db.Model):
             return json.loads(attr.value)
         return None
 
+    def set_attribute(self, key, value):
+        """Replace the value of an attribute; None removes it"""
+        EventAttribute.query.filter_by(event_id=self.id, key=key).delete()
+        if value is not None:
+            self.add_attribute(key, value)
+
 
 class EventAttribute(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -84,10 +142,15 @@ class Location(db.Model):
     events = db.relationship("Event", lazy=True, viewonly=True)
 
 
+def _position_cell(context):
+    parameters = context.get_current_parameters()
+    return grid_cell(parameters["latitude"], parameters["longitude"])
+
+
 class GPSPosition(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, index=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     altitude = db.Column(db.Float)
@@ -96,8 +159,165 @@ class GPSPosition(db.Model):
     bearing = db.Column(db.Float)
     provider = db.Column(db.String(50))
     source = db.Column(db.String(50))  # e.g. 'gpslogger' or 'gpx_import'
+    # Number of the grid.CELL_SIZE cell containing the point, for spatial
+    # lookups; filled in on every insert
+    cell = db.Column(db.Integer, default=_position_cell)
+
+    __table_args__ = (
+        # Every query reads one user's points over a time range
+        db.Index("ix_gps_position_user_id_timestamp", "user_id", "timestamp"),
+        # ...except "when was I near here", which reads them over an area
+        db.Index(
+            "ix_gps_position_user_id_cell_timestamp", "user_id", "cell", "timestamp"
+        ),
+        # A point is identified by who recorded it, when, and how it arrived
+        db.Index(
+            "ix_gps_position_user_id_timestamp_source",
+            "user_id",
+            "timestamp",
+            "source",
+            unique=True,
+        ),
+    )
 
     user = db.relationship("User", backref=db.backref("gps_positions", lazy=True))
 
+    @classmethod
+    def between(cls, user_id, start, end):
+        """Query a user's positions between two datetimes, oldest first"""
+        return cls.query.filter(
+            cls.user_id == user_id,
+            cls.timestamp >= start,
+            cls.timestamp <= end,
+        ).order_by(cls.timestamp)
+
     def __repr__(self):
         return f"<GPSPosition {self.timestamp}: {self.latitude},{self.longitude}>"
+
+
+class GPSDaySummary(db.Model):
+    """Statistics of the GPS points a user recorded on one day, in the user's
+    timezone"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+    # The first and last points, so new points can extend the distance
+    first_latitude = db.Column(db.Float)
+    first_longitude = db.Column(db.Float)
+    last_latitude = db.Column(db.Float)
+    last_longitude = db.Column(db.Float)
+    min_latitude = db.Column(db.Float)
+    min_longitude = db.Column(db.Float)
+    max_latitude = db.Column(db.Float)
+    max_longitude = db.Column(db.Float)
+    distance = db.Column(db.Float, nullable=False, default=0)  # metres
+    max_speed = db.Column(db.Float)  # metres per second
+
+    __table_args__ = (
+        db.Index("ix_gps_day_summary_user_id_day", "user_id", "day", unique=True),
+    )
+
+    user = db.relationship("User", backref=db.backref("gps_day_summaries", lazy=True))
+
+    @property
+    def bbox(self):
+        """The (min_lon, min_lat, max_lon, max_lat) of the day's points"""
+        if self.min_latitude is None:
+            return None
+        return [
+            self.min_longitude,
+            self.min_latitude,
+            self.max_longitude,
+            self.max_latitude,
+        ]
+
+    def to_dict(self):
+        return {
+            "date": self.day.isoformat(),
+            "point_count": self.point_count,
+            "first_timestamp": (
+                self.first_timestamp.isoformat() + "Z" if self.first_timestamp else None
+            ),
+            "last_timestamp": (
+                self.last_timestamp.isoformat() + "Z" if self.last_timestamp else None
+            ),
+            "bbox": self.bbox,
+            "distance": round(self.distance, 1),
+            "max_speed": self.max_speed,
+        }
+
+
+class GPSPendingRange(db.Model):
+    """The time range of GPS points inserted since their day summaries were
+    last updated, added to them by ingest.refresh_day_summaries.
+
+    Rows are only ever inserted and deleted, so writers logging points never
+    wait on each other here.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (db.Index("ix_gps_pending_range_user_id", "user_id"),)
+
+
+class GPSArchive(db.Model):
+    """The GPS points a user recorded on one UTC day, moved out of the
+    gps_position table and packed by archive.pack_positions"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+    # Bounding box of the points, so spatial lookups can skip the archive
+    min_latitude = db.Column(db.Float)
+    min_longitude = db.Column(db.Float)
+    max_latitude = db.Column(db.Float)
+    max_longitude = db.Column(db.Float)
+    data = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_gps_archive_user_id_day", "user_id", "day", unique=True),
+    )
+
+    user = db.relationship("User", backref=db.backref("gps_archives", lazy=True))
+
+    def __repr__(self):
+        return f"<GPSArchive {self.user_id} {self.day}: {self.point_count} points>"
+
+
+class ImportLedger(db.Model):
+    """A file that has been imported into a user's GPS history"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the file
+    filename = db.Column(db.String(255))
+    source = db.Column(db.String(50))  # e.g. 'gpx_import'
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index(
+            "ix_import_ledger_user_id_content_hash",
+            "user_id",
+            "content_hash",
+            unique=True,
+        ),
+    )
+
+    user = db.relationship("User", backref=db.backref("imports", lazy=True))
+
+    def __repr__(self):
+        return f"<ImportLedger {self.filename} {self.content_hash[:12]}>"
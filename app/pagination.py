@@ -0,0 +1,51 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+
+def encode_cursor(timestamp, row_id):
+    """Encode the (timestamp, id) key of the last row of a page as an opaque
+    cursor string"""
+    data = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor into a (timestamp, id) tuple.
+
+    Raises ValueError if the cursor is not valid.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+class KeysetPage:
+    """One page of a keyset-paginated query.
+
+    ``rows`` should hold up to ``limit + 1`` rows; iterating yields at most
+    ``limit`` of them. Once iteration is finished, ``next_cursor`` is the
+    cursor of the following page, or None if this was the last one. ``key``
+    returns the (timestamp, id) of a row.
+    """
+
+    def __init__(self, rows, limit, key):
+        self.rows = rows
+        self.limit = limit
+        self.key = key
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self.rows):
+            if count == self.limit:
+                # There is at least one more row, so the next page starts
+                # after the last row of this one
+                self.next_cursor = encode_cursor(*self.key(last))
+                break
+            last = row
+            yield row
@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .grid import EARTH_RADIUS
+
+# A saved location found by a LocationIndex query, ``distance`` metres away
+NearbyLocation = namedtuple("NearbyLocation", ["id", "place_name", "distance"])
+
+
+def unit_vectors(latitudes, longitudes):
+    """Points on the unit sphere, as an (n, 3) array, for arrays of degrees"""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+class LocationIndex:
+    """The saved locations of one user, for nearest and radius queries.
+
+    Built from rows with id, place_name, latitude and longitude. Locations
+    are kept as unit vectors sorted by latitude, so distances are exact
+    great circle distances (no special cases at the poles or antimeridian)
+    and a radius query only measures the locations in the band of
+    latitudes it can reach.
+    """
+
+    def __init__(self, locations):
+        rows = sorted(
+            (location.latitude, location.longitude, location.id, location.place_name)
+            for location in locations
+        )
+        self.latitudes = np.array([row[0] for row in rows], dtype=float)
+        self.vectors = unit_vectors(
+            self.latitudes, np.array([row[1] for row in rows], dtype=float)
+        )
+        self.ids = [row[2] for row in rows]
+        self.place_names = [row[3] for row in rows]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _distances(self, latitude, longitude, first=0, last=None):
+        # Great circle distance from the chord between the unit vectors,
+        # which unlike the dot product stays precise for nearby points
+        point = unit_vectors([latitude], [longitude])[0]
+        chords = np.linalg.norm(self.vectors[first:last] - point, axis=1)
+        return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chords / 2, 1))
+
+    def _results(self, rows, distances):
+        return [
+            NearbyLocation(self.ids[row], self.place_names[row], float(distance))
+            for row, distance in zip(rows, distances)
+        ]
+
+    def nearest(self, latitude, longitude, k=None):
+        """The ``k`` locations nearest to a point, or all of them, closest
+        first"""
+        if not len(self):
+            return []
+
+        distances = self._distances(latitude, longitude)
+        rows = np.arange(len(distances))
+        if k is not None and k < len(rows):
+            rows = np.argpartition(distances, max(k - 1, 0))[:k]
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return self._results(rows, distances[rows])
+
+    def within(self, latitude, longitude, radius):
+        """The locations within ``radius`` metres of a point, closest first"""
+        # No location further than this many degrees of latitude away can
+        # be within the radius
+        reach = np.degrees(radius / EARTH_RADIUS)
+        first = np.searchsorted(self.latitudes, latitude - reach)
+        last = np.searchsorted(self.latitudes, latitude + reach, "right")
+        if first >= last:
+            return []
+
+        distances = self._distances(latitude, longitude, first, last)
+        rows = np.flatnonzero(distances <= radius)
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return self._results(rows + first, distances[rows])
@@ -1,11 +1,12 @@
+import itertools
 import os
+import xml.etree.ElementTree as ET
 from datetime import datetime, time, timedelta
 
-import gpxpy
 import pytz
-import requests
 from flask import (
     Blueprint,
+    Response,
     current_app,
     flash,
     jsonify,
@@ -13,16 +14,49 @@ from flask import (
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required, login_user, logout_user
 from gpxpy.geo import haversine_distance
+from sqlalchemy import update
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
 from . import db
+from .archive import (
+    archived_positions,
+    iter_positions,
+    position_key,
+    positions_near,
+)
 from .forms import CheckInForm, EventForm
-from .model import APIKey, Event, GPSPosition, Location, User
+from .gpx import import_gpx_stream
+from .ingest import (
+    insert_positions,
+    parse_gps_point,
+    parse_timestamp,
+    read_gps_batch,
+)
+from .jobs import IMPORT_FILE_EXTENSIONS, ImportJob, stage_upload
+from .model import APIKey, Event, GPSDaySummary, GPSPosition, Location, User
+from .pagination import KeysetPage, decode_cursor
+from .places import LocationIndex
+from .summaries import timezone_changed
+from .tracks import (
+    BINARY_MIMETYPE,
+    POLYLINE_MIMETYPE,
+    STREAM_BATCH_SIZE,
+    TRACK_FORMATS,
+    encode_track_binary,
+    encode_track_polyline,
+    iter_feature_collection,
+    iter_json_array,
+    simplify_track,
+    tolerance_for_zoom,
+)
+from .trips import find_trips, trip_to_dict, trip_totals
+from .visits import detect_stays, merge_stays, suggest_events, track_arrays
 
 # Create blueprint
 main_bp = Blueprint("main", __name__)
@@ -56,6 +90,7 @@ def login():
 
         # Save the user's timezone in the session
         session["timezone"] = request.form.get("timezone")
+        request_summary_timezone(user, session["timezone"])
 
         next_page = request.args.get("next")
         if next_page:
@@ -172,6 +207,7 @@ def api_keys():
             if key:
                 db.session.delete(key)
                 db.session.commit()
+                current_app.extensions["api_key_cache"].pop(key.key)
                 flash("API key deleted", "success")
 
     api_keys = APIKey.query.filter_by(user_id=current_user.id).all()
@@ -213,13 +249,7 @@ def timeline():
         datetime.combine(current_date, datetime.max.time())
     ).astimezone(pytz.UTC)
 
-    events_utc = (
-        Event.query.filter_by(user_id=current_user.id)
-        .filter(Event.start_time >= start_of_day_utc)
-        .filter(Event.start_time <= end_of_day_utc)
-        .order_by(Event.start_time)
-        .all()
-    )
+    events_utc = Event.between(current_user.id, start_of_day_utc, end_of_day_utc).all()
 
     # Convert event times to user's local timezone
     events_local = []
@@ -229,9 +259,13 @@ def timeline():
             event.end_time = event.end_time.replace(tzinfo=pytz.UTC).astimezone(user_tz)
         events_local.append(event)
 
+    # Fit the map to the day's track before the track itself has loaded
+    summary = get_day_summary(current_date, user_tz)
+
     return render_template(
         "timeline.html",
         events=events_local,
+        track_bbox=summary.bbox if summary else None,
         yesterday=yesterday,
         tomorrow=tomorrow,
         current_date=current_date.strftime("%Y-%m-%d"),
@@ -277,50 +311,36 @@ def add_event():
             datetime.combine(current_date, time.max)
         ).astimezone(pytz.UTC)
 
-        # Find GPS points near the clicked location (within ~100 meters)
-        nearby_points = (
-            GPSPosition.query.filter(
-                GPSPosition.user_id == current_user.id,
-                GPSPosition.timestamp >= start_of_day,
-                GPSPosition.timestamp <= end_of_day,
-                # Approximate distance filter (0.001 degree is roughly 100m)
-                GPSPosition.latitude.between(lat - 0.001, lat + 0.001),
-                GPSPosition.longitude.between(lon - 0.001, lon + 0.001),
-            )
-            .order_by(GPSPosition.timestamp)
-            .all()
+        # Find the first GPS point of the day near the clicked location
+        nearby_point = next(
+            positions_near(
+                current_user.id,
+                lat,
+                lon,
+                current_app.config["NEARBY_POINT_RADIUS"],
+                start_of_day,
+                end_of_day,
+            ),
+            None,
         )
 
-        # If there are nearby points, use the timestamp from the first one
-        if nearby_points:
+        # If there is a nearby point, use its timestamp
+        if nearby_point:
+            pos, _ = nearby_point
             # Convert UTC time to user's local timezone
-            local_time = (
-                nearby_points[0].timestamp.replace(tzinfo=pytz.UTC).astimezone(user_tz)
-            )
+            local_time = pos.timestamp.replace(tzinfo=pytz.UTC).astimezone(user_tz)
             # Set the form default time
             form.start_time.data = local_time
 
-        # Find locations near the clicked point, sorted by distance
-        locations = Location.query.filter_by(user_id=current_user.id).all()
-
-        # Sort locations by distance to clicked point
-        for location in locations:
-            location.distance = haversine_distance(
-                lat,
-                lon,
-                location.latitude,
-                location.longitude,
-            )
-
-        # Sort locations by distance from closest to furthest
-        sorted_locations = sorted(locations, key=lambda x: x.distance)
+        # Every location stays selectable, closest to the clicked point first
+        nearby_locations = get_location_index(current_user.id).nearest(lat, lon)
 
         # Populate the select field with sorted locations
         form.location_id.choices = [
             ("new", "-- Add New Location --"),
             *[
                 (str(l.id), l.place_name + f" ({l.distance:0.1f}m)")
-                for l in sorted_locations
+                for l in nearby_locations
             ],
         ]
 
@@ -395,7 +415,11 @@ def add_event():
 
         # Add to database
         db.session.add(new_event)
+        db.session.flush()  # This assigns an ID to new_event
+        update_trip_attribute(new_event)
         db.session.commit()
+        if form.location_id.data == "new":
+            invalidate_location_index(current_user.id)
 
         # Go back to the timeline for the event's date
         date_str = start_datetime_local.strftime("%Y-%m-%d")
@@ -477,8 +501,12 @@ def edit_event(event_id):
         else:
             event.location_id = None
 
+        update_trip_attribute(event)
+
         # Save changes
         db.session.commit()
+        if location_id == "new":
+            invalidate_location_index(current_user.id)
         flash("Event updated successfully!", "success")
 
         # Redirect to the timeline for the event's date
@@ -530,6 +558,49 @@ def delete_event(event_id):
     )
 
 
+def nearby_user_locations(lat, lon, radius):
+    """The current user's locations within ``radius`` metres, closest first,
+    with their distance set on them"""
+    distances = {
+        l.id: l.distance
+        for l in get_location_index(current_user.id).within(lat, lon, radius)
+    }
+    if not distances:
+        return []
+
+    user_locations = Location.query.filter(Location.id.in_(distances)).all()
+    for location in user_locations:
+        location.distance = distances[location.id]
+        location.distance_km = location.distance / 1000
+        location.distance_m = location.distance
+    user_locations.sort(key=lambda location: location.distance)
+    return user_locations
+
+
+def get_location_index(user_id):
+    """The LocationIndex of a user's saved locations, built on first use"""
+    cache = current_app.extensions["location_index_cache"]
+    index = cache.get(user_id)
+    if index is None:
+        index = LocationIndex(
+            Location.query.filter_by(user_id=user_id)
+            .with_entities(
+                Location.id,
+                Location.place_name,
+                Location.latitude,
+                Location.longitude,
+            )
+            .all()
+        )
+        cache.set(user_id, index)
+    return index
+
+
+def invalidate_location_index(user_id):
+    """Drop a user's cached LocationIndex after their locations change"""
+    current_app.extensions["location_index_cache"].pop(user_id)
+
+
 # Locations routes
 @main_bp.route("/locations", methods=["GET"])
 @login_required
@@ -561,6 +632,7 @@ def add_location():
 
         db.session.add(new_location)
         db.session.commit()
+        invalidate_location_index(current_user.id)
 
         flash("Location added successfully!", "success")
         return redirect(url_for("main.locations"))
@@ -591,6 +663,7 @@ def edit_location(location_id):
         location.longitude = float(request.form.get("longitude"))
 
         db.session.commit()
+        invalidate_location_index(current_user.id)
         flash("Location updated successfully!", "success")
         return redirect(url_for("main.locations"))
 
@@ -618,6 +691,7 @@ def delete_location(location_id):
 
         db.session.delete(location)
         db.session.commit()
+        invalidate_location_index(current_user.id)
         flash("Location deleted successfully!", "success")
         return redirect(url_for("main.locations"))
 
@@ -628,14 +702,16 @@ def delete_location(location_id):
 @login_required
 def import_gpx():
     if request.method == "POST":
+        # Uploads are streamed, so they may exceed the usual request limit
+        request.max_content_length = current_app.config["GPX_IMPORT_MAX_CONTENT_LENGTH"]
+
         # Check if the post request has the file part
         if "gpx_file" not in request.files:
             flash("No file part", "danger")
             return redirect(request.url)
 
         files = request.files.getlist("gpx_file")  # Get a list of files
-        total_points_added = 0
-        files_processed = 0
+        staged_files = []
         errors = []
 
         for file in files:
@@ -643,60 +719,38 @@ def import_gpx():
                 flash("No selected file", "danger")
                 continue  # Skip to the next file
 
-            if file and file.filename.endswith(".gpx"):
+            if file and file.filename.lower().endswith(IMPORT_FILE_EXTENSIONS):
                 filename = secure_filename(file.filename)
-                file_path = os.path.join(current_app.config["UPLOAD_FOLDER"], filename)
-
-                try:
-                    file.save(file_path)
-
-                    # Process the GPX file
-                    with open(file_path, "r") as gpx_file_content:
-                        gpx = gpxpy.parse(gpx_file_content)
-
-                    points_added_this_file = 0
-                    for track in gpx.tracks:
-                        for segment in track.segments:
-                            for point in segment.points:
-                                # Create GPS position for each point
-                                position = GPSPosition(
-                                    user_id=current_user.id,
-                                    timestamp=point.time,
-                                    latitude=point.latitude,
-                                    longitude=point.longitude,
-                                    altitude=point.elevation,
-                                    speed=point.speed,
-                                    source="gpx_import",
-                                )
-                                db.session.add(position)
-                                points_added_this_file += 1
-
-                    db.session.commit()
-                    total_points_added += points_added_this_file
-                    files_processed += 1
-
-                except Exception as e:
-                    db.session.rollback()  # Rollback changes for the current file if an error occurs
-                    errors.append(f"Error processing file {filename}: {str(e)}")
-
-                finally:
-                    # Remove the file after processing
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                # Keep a copy to import after this request has finished
+                path, content_hash = stage_upload(
+                    file, current_app.config["UPLOAD_FOLDER"]
+                )
+                staged_files.append((filename, path, content_hash))
             else:
                 errors.append(
-                    f"Invalid file type: {file.filename}. Only .gpx files are allowed."
+                    f"Invalid file type: {file.filename}. "
+                    "Only .gpx and location history .json files are allowed."
                 )
 
-        if files_processed > 0:
-            flash(
-                f"Successfully imported {total_points_added} GPS points from {files_processed} file(s).",
-                "success",
+        job = None
+        if staged_files:
+            job = current_app.extensions["job_runner"].submit(
+                ImportJob(current_user.id, staged_files)
+            )
+
+        if request.accept_mimetypes.best == "application/json":
+            return (
+                jsonify({"job_id": job.id if job else None, "errors": errors}),
+                202 if job else 400,
             )
 
         for error in errors:
             flash(error, "danger")
 
+        if job:
+            flash(f"Importing {len(staged_files)} file(s) in the background.", "info")
+            return redirect(url_for("main.gps_data", job=job.id))
+
         return redirect(url_for("main.gps_data"))
 
     return render_template("import_gpx.html")
@@ -736,16 +790,18 @@ def gps_data():
         datetime.combine(current_date, datetime.max.time())
     ).astimezone(pytz.UTC)
 
-    gps_count = (
-        GPSPosition.query.filter_by(user_id=current_user.id)
-        .filter(GPSPosition.timestamp >= start_of_day)
-        .filter(GPSPosition.timestamp <= end_of_day)
-        .count()
-    )
+    summary = get_day_summary(current_date, user_tz)
+    if summary is not None:
+        gps_count = summary.point_count
+    else:
+        recent = GPSPosition.between(current_user.id, start_of_day, end_of_day)
+        archived = archived_positions(current_user.id, start_of_day, end_of_day)
+        gps_count = recent.order_by(None).count() + sum(1 for _ in archived)
 
     return render_template(
         "gps_data.html",
         gps_count=gps_count,
+        import_job_id=request.args.get("job"),
         yesterday=yesterday,
         tomorrow=tomorrow,
         current_date=current_date.strftime("%Y-%m-%d"),
@@ -762,6 +818,7 @@ def set_timezone():
 
     if timezone:
         session["timezone"] = timezone
+        request_summary_timezone(current_user, timezone)
         return jsonify({"status": "success"})
 
     return jsonify({"status": "error", "message": "No timezone provided"}), 400
@@ -772,28 +829,356 @@ def get_user_timezone():
     return pytz.timezone(session.get("timezone") or "UTC")
 
 
+def request_summary_timezone(user, timezone):
+    """Move the user's day summaries to ``timezone`` if it is a new one.
+
+    The summaries are rebuilt by the job runner. Until a day's summary is
+    rebuilt in the new timezone, get_day_summary returns None for it and
+    pages compute the day from its points instead.
+    """
+    if timezone_changed(user, timezone):
+        current_app.extensions["job_runner"].rebuild_summaries(user.id, timezone)
+
+
+def get_day_summary(day, user_tz):
+    """The current user's GPS summary for ``day`` in ``user_tz``.
+
+    Summaries are kept in the timezone stored for the user, so None is
+    returned when ``user_tz`` is a different one, or the day's summary is
+    still being rebuilt. A day without points has an empty summary.
+
+    Summaries are brought up to date by the job runner, so points logged in
+    the last moments may not be counted yet.
+    """
+    complete_before = current_user.summaries_complete_before
+    if user_tz.zone != current_user.timezone or (
+        complete_before is not None and day >= complete_before
+    ):
+        return None
+
+    return GPSDaySummary.query.filter_by(
+        user_id=current_user.id, day=day
+    ).first() or GPSDaySummary(day=day, point_count=0, distance=0)
+
+
+@main_bp.route("/api/gps/days", methods=["GET"])
+@login_required
+def get_gps_days():
+    """Summaries of the days with GPS data, between the optional ``start``
+    and ``end`` dates (YYYY-MM-DD, inclusive).
+
+    Days are in the user's timezone, so the result can fill a calendar of
+    the days that have data. While the summaries are being rebuilt, only
+    the days rebuilt so far are listed and ``complete`` is false.
+    """
+    query = GPSDaySummary.query.filter(
+        GPSDaySummary.user_id == current_user.id, GPSDaySummary.point_count > 0
+    )
+    complete_before = current_user.summaries_complete_before
+    if complete_before is not None:
+        query = query.filter(GPSDaySummary.day < complete_before)
+
+    try:
+        if request.args.get("start"):
+            start = datetime.strptime(request.args["start"], "%Y-%m-%d").date()
+            query = query.filter(GPSDaySummary.day >= start)
+        if request.args.get("end"):
+            end = datetime.strptime(request.args["end"], "%Y-%m-%d").date()
+            query = query.filter(GPSDaySummary.day <= end)
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    return jsonify(
+        {
+            "timezone": current_user.timezone,
+            "complete": complete_before is None,
+            "days": [
+                summary.to_dict() for summary in query.order_by(GPSDaySummary.day)
+            ],
+        }
+    )
+
+
+@main_bp.route("/api/gps/near", methods=["GET"])
+@login_required
+def get_gps_near():
+    """Positions within ``radius`` metres of ``lat``/``lon``, newest first.
+
+    Optional ``start`` and ``end`` timestamps limit the time range and
+    ``limit`` the number of positions, so ``limit=1`` answers "when was I
+    last here". Each feature carries its ``distance`` in metres.
+    """
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat and lon are required"}), 400
+
+    radius = request.args.get("radius", 100, type=float)
+    max_radius = current_app.config["GPS_NEAR_MAX_RADIUS"]
+    if not 0 < radius <= max_radius:
+        return jsonify({"error": f"radius must be between 0 and {max_radius}"}), 400
+
+    try:
+        start = request.args.get("start")
+        start = parse_timestamp(start) if start else None
+        end = request.args.get("end")
+        end = parse_timestamp(end) if end else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page_size = current_app.config["GPS_PAGE_SIZE"]
+    limit = min(max(request.args.get("limit", 100, type=int), 1), page_size)
+
+    features = []
+    nearby = positions_near(
+        current_user.id, lat, lon, radius, start, end, newest_first=True
+    )
+    for pos, distance in itertools.islice(nearby, limit):
+        feature = position_feature(pos)
+        feature["properties"]["distance"] = round(distance, 1)
+        features.append(feature)
+
+    return jsonify({"type": "FeatureCollection", "features": features})
+
+
+@main_bp.route("/api/gps/trips", methods=["GET"])
+@login_required
+def get_gps_trips():
+    """The trips between the places the user stayed on ``date``
+    (YYYY-MM-DD, in the user's timezone), with their totals"""
+    user_tz = get_user_timezone()
+    try:
+        date_obj = datetime.strptime(request.args.get("date", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    # The day's point count changes whenever points are added, so cached
+    # trips are never stale; without a summary there is nothing to key on
+    summary = get_day_summary(date_obj, user_tz)
+    cache = current_app.extensions["trip_cache"]
+    cache_key = None
+    if summary is not None:
+        cache_key = (current_user.id, date_obj, user_tz.zone, summary.point_count)
+
+    trips = cache.get(cache_key) if cache_key else None
+    if trips is None:
+        start = user_tz.localize(datetime.combine(date_obj, time.min))
+        end = user_tz.localize(datetime.combine(date_obj, time.max))
+        trips = find_user_trips(start, end)
+        if cache_key:
+            cache.set(cache_key, trips)
+
+    return jsonify(
+        {
+            "date": date_obj.isoformat(),
+            "trips": [trip_to_dict(trip) for trip in trips],
+            "totals": trip_totals(trips),
+        }
+    )
+
+
+def find_user_trips(start, end):
+    """The current user's trips between two datetimes"""
+    config = current_app.config
+    times, latitudes, longitudes = track_arrays(
+        iter_positions(current_user.id, start, end)
+    )
+    stays = merge_stays(
+        detect_stays(
+            times,
+            latitudes,
+            longitudes,
+            config["STAY_RADIUS"],
+            config["STAY_MIN_DURATION"],
+        ),
+        config["STAY_RADIUS"],
+        config["STAY_MERGE_GAP"],
+    )
+    return find_trips(
+        times,
+        latitudes,
+        longitudes,
+        stays,
+        config["TRIP_MAX_GAP"],
+        config["TRIP_MAX_JUMP"],
+        config["TRIP_MIN_DISTANCE"],
+    )
+
+
+def update_trip_attribute(event):
+    """Store the totals of the trips during a travel event as its "trip"
+    attribute, or remove it from events that are not travel"""
+    totals = None
+    if event.event_type == "travel" and event.end_time:
+        totals = trip_totals(find_user_trips(event.start_time, event.end_time))
+    event.set_attribute("trip", totals)
+
+
+@main_bp.route("/api/events/suggestions", methods=["GET"])
+@login_required
+def get_event_suggestions():
+    """Suggested events for the places the user stayed on ``date``
+    (YYYY-MM-DD, in the user's timezone), or between the ``start`` and ``end``
+    timestamps, at most EVENT_SUGGESTION_MAX_DAYS apart"""
+    if request.args.get("date"):
+        user_tz = get_user_timezone()
+        try:
+            date_obj = datetime.strptime(request.args["date"], "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+        start = user_tz.localize(datetime.combine(date_obj, time.min))
+        end = user_tz.localize(datetime.combine(date_obj, time.max))
+        start = start.astimezone(pytz.UTC).replace(tzinfo=None)
+        end = end.astimezone(pytz.UTC).replace(tzinfo=None)
+    elif request.args.get("start") and request.args.get("end"):
+        try:
+            start = parse_timestamp(request.args["start"])
+            end = parse_timestamp(request.args["end"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        return jsonify({"error": "Pass date, or start and end"}), 400
+
+    config = current_app.config
+    max_days = config["EVENT_SUGGESTION_MAX_DAYS"]
+    if end < start:
+        return jsonify({"error": "end must not be before start"}), 400
+    if end - start > timedelta(days=max_days):
+        return (
+            jsonify({"error": f"start and end must be at most {max_days} days apart"}),
+            400,
+        )
+
+    suggestions = suggest_events(
+        current_user.id,
+        start,
+        end,
+        radius=config["STAY_RADIUS"],
+        min_duration=config["STAY_MIN_DURATION"],
+        merge_gap=config["STAY_MERGE_GAP"],
+        location_radius=config["STAY_LOCATION_RADIUS"],
+    )
+    return jsonify({"suggestions": suggestions})
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+# Fields /api/events can return, with their column and how they are encoded
+EVENT_FIELDS = {
+    "id": (Event.id, None),
+    "type": (Event.event_type, None),
+    "title": (Event.title, None),
+    "start_time": (Event.start_time, _isoformat),
+    "end_time": (Event.end_time, _isoformat),
+    "location_id": (Event.location_id, None),
+    "notes": (Event.notes, None),
+}
+DEFAULT_EVENT_FIELDS = ["id", "type", "title", "start_time", "end_time"]
+
+
 @main_bp.route("/api/events", methods=["GET"])
 @login_required
 def get_events():
-    events = (
-        Event.query.filter_by(user_id=current_user.id)
-        .order_by(Event.start_time.desc())
-        .all()
+    """The user's events, newest first.
+
+    Filters: ``start`` and ``end`` timestamps on the start time, ``type``
+    (comma separated) and ``location_id``; ``fields`` (comma separated)
+    picks the fields returned. With ``limit`` the events are paginated on
+    (start_time, id): the URL of the next page is given in the Link header,
+    and its cursor in X-Next-Cursor. Without it every matching event is
+    streamed.
+    """
+    try:
+        start = request.args.get("start")
+        start = parse_timestamp(start) if start else None
+        end = request.args.get("end")
+        end = parse_timestamp(end) if end else None
+        cursor = request.args.get("cursor")
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    event_types = [t for t in request.args.get("type", "").split(",") if t]
+    location_id = request.args.get("location_id")
+    if location_id is not None:
+        try:
+            location_id = int(location_id)
+        except ValueError:
+            return jsonify({"error": "location_id must be an integer"}), 400
+
+    fields = request.args.get("fields")
+    fields = fields.split(",") if fields else DEFAULT_EVENT_FIELDS
+    unknown = [field for field in fields if field not in EVENT_FIELDS]
+    if unknown:
+        return (
+            jsonify(
+                {
+                    "error": f"Unknown fields: {', '.join(unknown)}. "
+                    f"Use {', '.join(EVENT_FIELDS)}"
+                }
+            ),
+            400,
+        )
+
+    # Only the selected columns are loaded, with the key of each row
+    query = Event.newest_first(
+        current_user.id, start, end, event_types, location_id, before
+    ).with_entities(
+        Event.start_time.label("key_time"),
+        Event.id.label("key_id"),
+        *(EVENT_FIELDS[field][0].label(field) for field in fields),
     )
 
-    # Convert to JSON representation
-    result = []
-    for event in events:
-        event_data = {
-            "id": event.id,
-            "type": event.event_type,
-            "title": event.title,
-            "start_time": event.start_time.isoformat(),
-            "end_time": event.end_time.isoformat() if event.end_time else None,
+    def event_dict(row):
+        values = row._mapping
+        return {
+            field: (
+                EVENT_FIELDS[field][1](values[field])
+                if EVENT_FIELDS[field][1]
+                else values[field]
+            )
+            for field in fields
         }
-        result.append(event_data)
 
-    return jsonify(result)
+    limit = request.args.get("limit", type=int)
+    if limit is None:
+        # Exports are written as they are read
+        rows = db.session.execute(
+            query.statement.execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        return Response(
+            stream_with_context(iter_json_array(map(event_dict, rows))),
+            mimetype="application/json",
+        )
+
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    limit = min(limit, current_app.config["EVENT_PAGE_SIZE"])
+
+    # One extra row tells whether there is another page
+    page = KeysetPage(
+        query.limit(limit + 1).all(), limit, lambda row: (row.key_time, row.key_id)
+    )
+    response = jsonify([event_dict(row) for row in page])
+    if page.next_cursor:
+        args = request.args.to_dict(flat=False)
+        args["cursor"] = page.next_cursor
+        next_url = url_for("main.get_events", _external=True, **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return response
+
+
+@main_bp.route("/api/jobs/<job_id>", methods=["GET"])
+@login_required
+def get_job(job_id):
+    job = current_app.extensions["job_runner"].get(job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job.to_dict())
 
 
 @main_bp.route("/api/location", methods=["POST"])
@@ -806,6 +1191,22 @@ def log_location():
 @main_bp.route("/api/gps/positions", methods=["GET"])
 @login_required
 def get_gps_positions():
+    track_format = get_track_format()
+    if not track_format:
+        return (
+            jsonify({"error": "Invalid format. Use geojson, polyline or binary"}),
+            400,
+        )
+
+    # Optional simplification; an explicit tolerance wins over a zoom level
+    tolerance = request.args.get("tolerance", type=float)
+    zoom = request.args.get("zoom", type=float)
+    if tolerance is None and zoom is not None:
+        tolerance = tolerance_for_zoom(zoom)
+
+    if not request.args.get("date"):
+        return get_gps_positions_range(track_format, tolerance)
+
     date = request.args.get("date")
     user_tz = get_user_timezone()
 
@@ -822,106 +1223,333 @@ def get_gps_positions():
     except ValueError:
         return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-    # Query positions for the specified day
-    positions = (
-        GPSPosition.query.filter(
-            GPSPosition.user_id == current_user.id,
-            GPSPosition.timestamp >= start_datetime,
-            GPSPosition.timestamp <= end_datetime,
+    if tolerance:
+        summary = get_day_summary(date_obj, user_tz)
+        positions = get_simplified_track(
+            current_user.id,
+            date_obj,
+            user_tz,
+            start_datetime,
+            end_datetime,
+            tolerance,
+            summary.point_count if summary is not None else None,
         )
-        .order_by(GPSPosition.timestamp)
-        .all()
+    elif track_format == "geojson":
+        # Fetched in batches while the response is written
+        positions = iter_positions(current_user.id, start_datetime, end_datetime)
+    else:
+        positions = list(iter_positions(current_user.id, start_datetime, end_datetime))
+
+    return track_response(positions, track_format)
+
+
+def get_gps_positions_range(track_format, tolerance):
+    """Positions between the ``start`` and ``end`` timestamps, optionally
+    limited to a ``bbox`` of min_lon,min_lat,max_lon,max_lat.
+
+    Results are paginated on (timestamp, id). Each page carries the cursor of
+    the next one, which is passed back as ``cursor`` with the same filters.
+    """
+    try:
+        start = request.args.get("start")
+        start = parse_timestamp(start) if start else None
+        end = request.args.get("end")
+        end = parse_timestamp(end) if end else None
+        bbox = parse_bbox(request.args.get("bbox"))
+        cursor = request.args.get("cursor")
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page_size = current_app.config["GPS_PAGE_SIZE"]
+    limit = request.args.get("limit", page_size, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    limit = min(limit, page_size)
+
+    # One extra row tells whether there is another page
+    page = KeysetPage(
+        iter_positions(current_user.id, start, end, bbox, after, limit=limit + 1),
+        limit,
+        position_key,
     )
 
-    # Convert to GeoJSON for mapping
-    features = []
-    for pos in positions:
-        features.append(
-            {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [pos.longitude, pos.latitude],
-                },
-                "properties": {
-                    "id": pos.id,
-                    "timestamp": pos.timestamp.isoformat() + "Z",
-                    "altitude": pos.altitude,
-                    "accuracy": pos.accuracy,
-                    "speed": pos.speed,
-                    "source": pos.source,
-                },
-            }
+    if track_format == "geojson" and not tolerance:
+        return track_response(page, track_format, page)
+
+    positions = list(page)
+    if tolerance:
+        kept = simplify_track(
+            [(pos.longitude, pos.latitude) for pos in positions], tolerance
         )
+        positions = [positions[index] for index in kept]
+    return track_response(positions, track_format, page)
 
-    geojson = {"type": "FeatureCollection", "features": features}
 
-    return jsonify(geojson)
+def parse_bbox(value):
+    """Parse a min_lon,min_lat,max_lon,max_lat bounding box.
 
+    Returns None if ``value`` is empty and raises ValueError if it is invalid.
+    """
+    if not value:
+        return None
 
-@main_bp.route("/api/gps/log", methods=["POST"])
-def log_gps_position():
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError("Invalid bbox. Use min_lon,min_lat,max_lon,max_lat")
+
+    if not (-90 <= min_lat <= max_lat <= 90) or not (
+        -180 <= min_lon <= 180 and -180 <= max_lon <= 180
+    ):
+        raise ValueError("bbox is out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def track_response(positions, track_format, page=None):
+    """Encode position rows in ``track_format``.
+
+    When ``page`` is given the response includes the cursor of the next page:
+    as ``next`` in the JSON formats and the X-Next-Cursor header otherwise.
+    """
+    if track_format == "polyline":
+        data = encode_track_polyline(positions)
+        if page:
+            data["next"] = page.next_cursor
+        response = jsonify(data)
+        response.mimetype = POLYLINE_MIMETYPE
+        return response
+
+    if track_format == "binary":
+        response = Response(encode_track_binary(positions), mimetype=BINARY_MIMETYPE)
+        if page and page.next_cursor:
+            response.headers["X-Next-Cursor"] = page.next_cursor
+        return response
+
+    # Convert to GeoJSON for mapping, writing features as they are read. The
+    # next cursor is only known once the last feature has been written.
+    features = (position_feature(pos) for pos in positions)
+    members = (lambda: {"next": page.next_cursor}) if page else None
+    return Response(
+        stream_with_context(iter_feature_collection(features, members=members)),
+        mimetype="application/json",
+    )
+
+
+def get_track_format():
+    """The track encoding asked for with ``format=`` or the Accept header.
+
+    Returns None if ``format`` names an unknown encoding.
+    """
+    track_format = request.args.get("format")
+    if track_format:
+        return track_format if track_format in TRACK_FORMATS.values() else None
+
+    best = request.accept_mimetypes.best_match(TRACK_FORMATS, "application/json")
+    return TRACK_FORMATS[best]
+
+
+def position_feature(pos):
+    """Convert a position row into a GeoJSON Feature for mapping"""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [pos.longitude, pos.latitude],
+        },
+        "properties": {
+            "id": pos.id,
+            "timestamp": pos.timestamp.isoformat() + "Z",
+            "altitude": pos.altitude,
+            "accuracy": pos.accuracy,
+            "speed": pos.speed,
+            "source": pos.source,
+        },
+    }
+
+
+def get_simplified_track(
+    user_id, date_obj, user_tz, start_datetime, end_datetime, tolerance, point_count
+):
+    """A user's positions between two datetimes simplified to ``tolerance``
+    metres.
+
+    Tracks are cached per (user, day, tolerance) and the day's point count,
+    which changes whenever points are added, so a cached track is never
+    stale. Without a point count there is nothing to key on and the track is
+    simplified afresh.
+    """
+    # Round so nearby tolerances share a cache entry
+    tolerance = float(f"{tolerance:.3g}")
+    cache = current_app.extensions["track_cache"]
+    cache_key = None
+    if point_count is not None:
+        cache_key = (user_id, date_obj, user_tz.zone, tolerance, point_count)
+
+    positions = cache.get(cache_key) if cache_key else None
+    if positions is not None:
+        return positions
+
+    positions = list(iter_positions(user_id, start_datetime, end_datetime))
+    kept = simplify_track(
+        [(pos.longitude, pos.latitude) for pos in positions], tolerance
+    )
+    positions = [positions[index] for index in kept]
+
+    if cache_key:
+        cache.set(cache_key, positions)
+    return positions
+
+
+class CachedAPIKey:
+    """The parts of an APIKey needed to authenticate requests"""
+
+    def __init__(self, key_record):
+        self.id = key_record.id
+        self.user_id = key_record.user_id
+        self.last_used = key_record.last_used
+
+
+def authenticate_api_key():
+    """Helper function to validate the API key sent with a request.
+
+    Returns a (key_record, error_response) tuple; error_response is set when
+    the key is missing or invalid. Validated keys are cached in-process.
+    Nothing is written; call touch_api_key once the request has succeeded.
+    """
     # Get API key from header or query parameter
     api_key = request.headers.get("X-API-Key") or request.args.get("api_key")
 
     if not api_key:
-        return jsonify({"error": "API key required"}), 401
-
-    # Validate API key
-    key_record = APIKey.query.filter_by(key=api_key).first()
-    if not key_record:
-        return jsonify({"error": "Invalid API key"}), 401
-
-    # Update last used timestamp
-    key_record.last_used = datetime.now(pytz.UTC)
-
-    # GPSLogger typically sends data as URL parameters
-    latitude = request.form.get("lat", type=float)
-    longitude = request.form.get("lon", type=float)
-    timestamp_str = request.form.get("time", type=str)  # ISO format
-    altitude = request.form.get("alt", type=float)
-    accuracy = request.form.get("acc", type=float)
-    speed = request.form.get("spd", type=float)
-    bearing = request.form.get("dir", type=float)
-    provider = request.form.get("prov", type=str)
-
-    # Validate required fields
-    if not all([latitude, longitude, timestamp_str]):
-        current_app.logger.error(
-            "Missing required parameters for GPS logging. latitude: %s, longitude: %s, timestamp: %s",
-            latitude,
-            longitude,
-            timestamp_str,
+        return None, (jsonify({"error": "API key required"}), 401)
+
+    cache = current_app.extensions["api_key_cache"]
+    key_record = cache.get(api_key)
+    if key_record is None:
+        db_record = APIKey.query.filter_by(key=api_key).first()
+        if not db_record:
+            return None, (jsonify({"error": "Invalid API key"}), 401)
+
+        key_record = CachedAPIKey(db_record)
+        cache.set(api_key, key_record)
+
+    return key_record, None
+
+
+def touch_api_key(key_record):
+    """Update the last used timestamp of a key, in the same transaction as
+    the request's writes, at most once per API_KEY_LAST_USED_INTERVAL"""
+    now = datetime.now(pytz.UTC).replace(tzinfo=None)
+    interval = timedelta(seconds=current_app.config["API_KEY_LAST_USED_INTERVAL"])
+    if key_record.last_used is None or now - key_record.last_used >= interval:
+        key_record.last_used = now
+        db.session.execute(
+            update(APIKey).where(APIKey.id == key_record.id).values(last_used=now)
         )
-        return jsonify({"error": "Missing required parameters"}), 400
+
+
+@main_bp.route("/api/gps/log", methods=["POST"])
+def log_gps_position():
+    key_record, error_response = authenticate_api_key()
+    if error_response:
+        return error_response
 
     try:
-        # Parse timestamp
-        timestamp = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+        # GPSLogger typically sends data as URL parameters
+        position = parse_gps_point(request.form, key_record.user_id, "gpslogger")
+    except (ValueError, TypeError) as e:
+        current_app.logger.error(f"Error logging GPS position: {str(e)}")
+        return jsonify({"error": str(e)}), 400
 
-        # Create GPS position
-        position = GPSPosition(
-            user_id=key_record.user_id,
-            timestamp=timestamp,
-            latitude=latitude,
-            longitude=longitude,
-            altitude=altitude if altitude else None,
-            accuracy=accuracy if accuracy else None,
-            speed=speed if speed else None,
-            bearing=bearing if bearing else None,
-            provider=provider,
-            source="gpslogger",
-        )
+    spool = current_app.extensions.get("gps_spool")
+    if spool:
+        # Acknowledge once the point is durably queued; it is inserted later
+        spool.append(position)
+    else:
+        insert_positions([position])
+    touch_api_key(key_record)
+    db.session.commit()
+    if not spool:
+        current_app.extensions["job_runner"].refresh_summaries([key_record.user_id])
 
-        db.session.add(position)
-        db.session.commit()
+    return jsonify({"status": "success"}), 200
 
-        return jsonify({"status": "success"}), 200
 
-    except (ValueError, TypeError) as e:
-        current_app.logger.error(f"Error logging GPS position: {str(e)}")
+@main_bp.route("/api/gps/log/batch", methods=["POST"])
+def log_gps_batch():
+    key_record, error_response = authenticate_api_key()
+    if error_response:
+        return error_response
+
+    try:
+        points = read_gps_batch(request)
+    except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
+    max_points = current_app.config["GPS_BATCH_MAX_POINTS"]
+    if len(points) > max_points:
+        return (
+            jsonify({"error": f"Too many points in batch (maximum {max_points})"}),
+            413,
+        )
+
+    # Validate every point, collecting failures so clients can retry only those
+    rows = []
+    rejected = []
+    for index, point in enumerate(points):
+        try:
+            if isinstance(point, Exception):
+                raise point
+            rows.append(parse_gps_point(point, key_record.user_id, "gpslogger"))
+        except (ValueError, TypeError) as e:
+            rejected.append({"index": index, "error": str(e)})
+
+    inserted = insert_positions(rows)
+    touch_api_key(key_record)
+    db.session.commit()
+    if inserted:
+        current_app.extensions["job_runner"].refresh_summaries([key_record.user_id])
+
+    return jsonify(
+        {
+            "status": "success",
+            "accepted": len(rows),
+            "duplicates": len(rows) - inserted,
+            "rejected": rejected,
+        }
+    )
+
+
+@main_bp.route("/api/gps/import", methods=["POST"])
+def import_gpx_api():
+    key_record, error_response = authenticate_api_key()
+    if error_response:
+        return error_response
+
+    # The request body is the GPX document itself and is parsed as it arrives
+    request.max_content_length = current_app.config["GPX_IMPORT_MAX_CONTENT_LENGTH"]
+
+    try:
+        points_read, points_inserted = import_gpx_stream(
+            request.stream,
+            key_record.user_id,
+            current_app.config["GPX_IMPORT_CHUNK_SIZE"],
+        )
+        touch_api_key(key_record)
+        db.session.commit()
+    except (ET.ParseError, ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({"error": f"Invalid GPX document: {str(e)}"}), 400
+    current_app.extensions["job_runner"].refresh_summaries([key_record.user_id])
+
+    return jsonify(
+        {
+            "status": "success",
+            "accepted": points_read,
+            "duplicates": points_read - points_inserted,
+        }
+    )
+
 
 @main_bp.route("/checkin", methods=["GET", "POST"])
 @login_required
@@ -932,85 +1560,18 @@ def checkin():
     lat = request.args.get("lat")
     lon = request.args.get("lon")
 
-    # Initialize empty lists for results
+    # Saved locations are listed at once; Foursquare venues are fetched by
+    # the page from /api/checkin/venues and merged in as they arrive
     combined_locations = []
-    max_distance_km = 0.5
 
     if lat and lon:
         # Convert to float
         try:
             lat = float(lat)
             lon = float(lon)
-
-            # Get user's locations
-            user_locations = Location.query.filter_by(user_id=current_user.id).all()
-
-            foursquare_venues_to_ignore = set(
-                [loc.source_id for loc in user_locations if loc.source == "foursquare"]
+            combined_locations = nearby_user_locations(
+                lat, lon, current_app.config["CHECKIN_RADIUS"]
             )
-
-            # Process user locations
-            for location in user_locations:
-                # Calculate distance
-                distance = haversine_distance(
-                    lat, lon, location.latitude, location.longitude
-                )
-                distance_km = distance / 1000
-
-                # Skip locations beyond 10km
-                if distance_km > max_distance_km:
-                    continue
-
-                # Add distance to location object
-                location.distance = distance
-                location.distance_km = distance_km
-                location.distance_m = distance
-                location.source = "user"
-
-                combined_locations.append(location)
-
-            # Get Foursquare locations
-            foursquare_venues = get_foursquare_venues(
-                lat, lon, radius=max_distance_km * 1000, limit=50
-            )
-
-            # Process Foursquare venues
-            for venue in foursquare_venues:
-                # Skip venues already in user's locations
-                if venue["id"] in foursquare_venues_to_ignore:
-                    continue
-
-                # Calculate distance
-                distance = haversine_distance(lat, lon, venue["lat"], venue["lon"])
-                distance_km = distance / 1000
-
-                # Skip locations beyond 10km (should be filtered by API, but double-check)
-                if distance_km > max_distance_km:
-                    continue
-
-                # Create a location-like object
-                venue_obj = type(
-                    "FoursquareVenue",
-                    (),
-                    {
-                        "id": venue["id"],
-                        "place_name": venue["name"],
-                        "category": venue["category"],
-                        "latitude": venue["lat"],
-                        "longitude": venue["lon"],
-                        "address": venue["address"],
-                        "distance": distance,
-                        "distance_km": distance_km,
-                        "distance_m": distance,
-                        "source": "foursquare",
-                    },
-                )
-
-                combined_locations.append(venue_obj)
-
-            # Sort all locations by distance
-            combined_locations.sort(key=lambda x: x.distance)
-
         except ValueError:
             flash("Invalid coordinates provided", "danger")
 
@@ -1076,6 +1637,7 @@ def checkin():
             )
             db.session.add(event)
             db.session.commit()
+            invalidate_location_index(current_user.id)
 
             flash(f"Checked in at {place_name}!", "success")
             return redirect(url_for("main.timeline"))
@@ -1085,60 +1647,56 @@ def checkin():
     )
 
 
-def get_foursquare_venues(lat, lon, radius=500, limit=10):
-    """Fetch nearby venues from Foursquare API"""
-    api_key = current_app.config.get("FOURSQUARE_API_KEY")
-    if not api_key:
-        return []
+@main_bp.route("/api/checkin/venues", methods=["GET"])
+@login_required
+def get_checkin_venues():
+    """Foursquare venues within CHECKIN_RADIUS of ``lat``/``lon`` that the
+    user has not saved yet, closest first"""
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required numbers"}), 400
+    radius = current_app.config["CHECKIN_RADIUS"]
+
+    venues = current_app.extensions["foursquare"].search(
+        lat, lon, radius=radius, limit=50
+    )
+    if venues is None:
+        return jsonify({"venues": [], "available": False})
+
+    # A saved Foursquare venue is at the venue's own coordinates, so it is
+    # among the saved locations within range if the venue is
+    venues_to_ignore = {
+        location.source_id
+        for location in nearby_user_locations(lat, lon, radius)
+        if location.source == "foursquare"
+    }
 
-    # API endpoint
-    url = "https://api.foursquare.com/v3/places/search"
+    results = []
+    for venue in venues:
+        # Skip venues already in user's locations
+        if venue["id"] in venues_to_ignore:
+            continue
 
-    # Parameters
-    params = {
-        "ll": f"{lat},{lon}",
-        "radius": int(radius),
-        "limit": limit,
-        "sort": "distance",
-    }
+        distance = haversine_distance(lat, lon, venue["lat"], venue["lon"])
+        if distance > radius:
+            continue
 
-    # Headers
-    headers = {"Accept": "application/json", "Authorization": api_key}
+        results.append({**venue, "distance": round(distance, 1)})
 
-    try:
-        response = requests.get(url, params=params, headers=headers)
-        print(response.request.url)
-        print(response.status_code)
-        if response.status_code != 200:
-            return []
-
-        data = response.json()
-        results = []
-
-        # Format results to match our needs
-        for venue in data.get("results", []):
-            if "geocodes" not in venue or "main" not in venue["geocodes"]:
-                continue
-
-            # Get category
-            category = (
-                venue.get("categories", [{}])[0].get("name", "Uncategorized")
-                if venue.get("categories")
-                else "Uncategorized"
-            )
+    return jsonify({"venues": results, "available": True})
 
-            results.append(
-                {
-                    "id": venue.get("fsq_id"),
-                    "name": venue.get("name"),
-                    "category": category,
-                    "lat": venue["geocodes"]["main"]["latitude"],
-                    "lon": venue["geocodes"]["main"]["longitude"],
-                    "address": venue.get("location", {}).get("formatted_address", ""),
-                }
-            )
 
-        return results
-    except Exception as e:
-        current_app.logger.error(f"Foursquare API error: {str(e)}")
-        return []
+@main_bp.route("/api/foursquare/stats", methods=["GET"])
+@login_required
+def get_foursquare_stats():
+    """Counters of the Foursquare searches made by the worker process that
+    answers, and whether its circuit breaker is open.
+
+    Each worker keeps its own counters, so ``pid`` tells them apart.
+    """
+    client = current_app.extensions["foursquare"]
+    return jsonify(
+        {"pid": os.getpid(), "configured": bool(client.api_key), **client.stats()}
+    )
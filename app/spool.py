@@ -0,0 +1,231 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy.exc import InterfaceError, OperationalError, ProgrammingError
+
+from . import db
+from .ingest import insert_positions
+
+# Errors that say more about the database than the spool file, such as a lost
+# connection or a table not migrated yet; the file is retried on a later pass
+RETRYABLE_ERRORS = (InterfaceError, OperationalError, ProgrammingError)
+
+
+class GPSSpool:
+    """Write-behind queue for GPS positions backed by an append-only spool file.
+
+    Points are acknowledged once they have been appended (and optionally
+    fsynced) to ``<pid>.spool`` in the spool folder. A background thread
+    periodically moves that file aside as ``<pid>-<n>.flushing`` and
+    group-commits its rows in batches. Files left behind by a process that
+    died are claimed and replayed by recover, which runs when the app is
+    created and from flask flush-gps-spool.
+
+    A file whose rows cannot be inserted is renamed to ``.failed`` and
+    logged, so the files after it are still flushed. Database errors that
+    are likely to pass, such as a lost connection, leave it in place for the
+    next pass instead.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.folder = app.config.get("GPS_SPOOL_FOLDER") or os.path.join(
+            app.instance_path, "gps_spool"
+        )
+        self.batch_size = app.config["GPS_SPOOL_BATCH_SIZE"]
+        self.flush_interval = app.config["GPS_SPOOL_FLUSH_INTERVAL"]
+        self.fsync = app.config["GPS_SPOOL_FSYNC"]
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._file = None
+        self._pending = 0
+        self._sequence = 0
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def _active_path(self):
+        return os.path.join(self.folder, f"{os.getpid()}.spool")
+
+    def _flushing_path(self, label):
+        return os.path.join(self.folder, f"{os.getpid()}-{label}.flushing")
+
+    def start(self):
+        """Start the background flusher"""
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            os.makedirs(self.folder, exist_ok=True)
+            self._thread = threading.Thread(
+                target=self._run, name="gps-spool-flusher", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def recover(self):
+        """Claim the spool files left by processes that are no longer running
+        and insert their rows.
+
+        Errors are logged rather than raised, and False is returned; claimed
+        files that could not be flushed are retried by this process's
+        flusher, or recovered again once it exits.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            self._claim_orphans()
+            self.flush()
+        except Exception:
+            self.app.logger.exception("Error recovering GPS spool")
+            return False
+        return True
+
+    def stop(self):
+        """Stop the background flusher and flush everything still queued"""
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+    def append(self, row):
+        """Durably queue a GPSPosition row for insertion"""
+        if self._thread is None:
+            self.start()
+
+        line = json.dumps(row, default=datetime.isoformat) + "\n"
+
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._active_path, "a", encoding="utf-8")
+
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._wakeup.set()
+
+    def flush(self):
+        """Insert every queued row into the database"""
+        with self._flush_lock:
+            self._rotate()
+
+            pattern = os.path.join(self.folder, f"{os.getpid()}-*.flushing")
+            for path in sorted(glob.glob(pattern)):
+                try:
+                    self._replay(path)
+                except RETRYABLE_ERRORS:
+                    raise
+                except Exception:
+                    self._set_aside(path)
+
+    def _rotate(self):
+        # Move the active spool file aside so appends continue in a new file
+        with self._lock:
+            if self._file is None:
+                return
+
+            self._file.close()
+            self._file = None
+            self._pending = 0
+            self._sequence += 1
+            os.replace(self._active_path, self._flushing_path(self._sequence))
+
+    def _replay(self, path):
+        with self.app.app_context():
+            rows = []
+            user_ids = set()
+            with open(path, encoding="utf-8") as spool_file:
+                for line_number, line in enumerate(spool_file, 1):
+                    try:
+                        row = json.loads(line)
+                        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                    except (KeyError, TypeError, ValueError):
+                        # A torn final line from a crash mid-append
+                        self.app.logger.warning(
+                            "Skipping unreadable line %d in GPS spool %s",
+                            line_number,
+                            path,
+                        )
+                        continue
+
+                    rows.append(row)
+                    user_ids.add(row["user_id"])
+                    if len(rows) >= self.batch_size:
+                        insert_positions(rows)
+                        db.session.commit()
+                        rows = []
+
+            insert_positions(rows)
+            db.session.commit()
+            # Add the whole file's points to the day summaries at once
+            self.app.extensions["job_runner"].refresh_summaries(user_ids)
+
+        os.remove(path)
+
+    def _set_aside(self, path):
+        # Rows committed before the failure are skipped as duplicates if the
+        # file is moved back to be replayed
+        failed_path = path.removesuffix(".flushing") + ".failed"
+        os.replace(path, failed_path)
+        self.app.logger.exception(
+            "Error flushing GPS spool file; moved it to %s", failed_path
+        )
+
+    def _claim_orphans(self):
+        # Claim spool files left by processes that are no longer running
+        for path in glob.glob(os.path.join(self.folder, "*")):
+            name = os.path.basename(path)
+            owner = name.split(".")[0].split("-")[0]
+            if (
+                name.endswith(".failed")
+                or not owner.isdigit()
+                or _process_alive(int(owner))
+            ):
+                continue
+
+            try:
+                os.replace(path, self._flushing_path(f"recovered{uuid.uuid4().hex}"))
+            except FileNotFoundError:
+                # Another process claimed it first
+                continue
+
+            self.app.logger.info("Recovered GPS spool file %s", name)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                # Leave the spool file in place and retry on the next pass
+                self.app.logger.exception("Error flushing GPS spool")
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        # Files named after this process predate it (the pid was reused)
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
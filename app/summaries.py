@@ -0,0 +1,205 @@
+from datetime import date, datetime, time, timedelta
+
+import pytz
+from gpxpy.geo import haversine_distance
+from sqlalchemy import delete, func, select
+
+from . import db
+from .archive import iter_positions
+from .model import GPSArchive, GPSDaySummary, GPSPendingRange, GPSPosition, User
+
+# Days of summaries rebuild_day_summaries writes per transaction
+REBUILD_BATCH_DAYS = 30
+
+
+def local_day(timestamp, tz):
+    """The date in ``tz`` of a naive UTC timestamp"""
+    return pytz.UTC.localize(timestamp).astimezone(tz).date()
+
+
+def day_bounds(day, tz):
+    """The naive UTC datetimes at which ``day`` and the day after it start
+    in ``tz``"""
+    start = tz.localize(datetime.combine(day, time.min)).astimezone(pytz.UTC)
+    end = tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+    return start.replace(tzinfo=None), end.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def _path_length(points):
+    return sum(
+        haversine_distance(a[1], a[2], b[1], b[2]) for a, b in zip(points, points[1:])
+    )
+
+
+def _min(*values):
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+
+def _max(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def extend_summary(summary, points):
+    """Add (timestamp, latitude, longitude, speed) points, sorted by
+    timestamp, to a day summary.
+
+    The points must all come before or all after the points already in the
+    summary, since the distance between the others is not known. Returns
+    False without changing the summary if they do not.
+    """
+    if not points:
+        return True
+
+    first, last = points[0], points[-1]
+    distance = _path_length(points)
+
+    if not summary.point_count:
+        summary.first_timestamp, summary.first_latitude, summary.first_longitude = (
+            first[:3]
+        )
+        summary.last_timestamp, summary.last_latitude, summary.last_longitude = last[:3]
+    elif first[0] > summary.last_timestamp:
+        distance += haversine_distance(
+            summary.last_latitude, summary.last_longitude, first[1], first[2]
+        )
+        summary.last_timestamp, summary.last_latitude, summary.last_longitude = last[:3]
+    elif last[0] < summary.first_timestamp:
+        distance += haversine_distance(
+            last[1], last[2], summary.first_latitude, summary.first_longitude
+        )
+        summary.first_timestamp, summary.first_latitude, summary.first_longitude = (
+            first[:3]
+        )
+    else:
+        return False
+
+    latitudes = [point[1] for point in points]
+    longitudes = [point[2] for point in points]
+    summary.point_count = (summary.point_count or 0) + len(points)
+    summary.distance = (summary.distance or 0) + distance
+    summary.min_latitude = _min(summary.min_latitude, *latitudes)
+    summary.max_latitude = _max(summary.max_latitude, *latitudes)
+    summary.min_longitude = _min(summary.min_longitude, *longitudes)
+    summary.max_longitude = _max(summary.max_longitude, *longitudes)
+    summary.max_speed = _max(summary.max_speed, *(point[3] for point in points))
+    return True
+
+
+def summarize_points(summary, points):
+    """Set a day summary from all of the day's points, sorted by timestamp"""
+    summary.point_count = 0
+    summary.distance = 0
+    summary.first_timestamp = summary.last_timestamp = None
+    summary.min_latitude = summary.max_latitude = None
+    summary.min_longitude = summary.max_longitude = None
+    summary.max_speed = None
+    extend_summary(summary, points)
+
+
+def summarize_day(summary, tz):
+    """Recompute a day summary from the GPS points of its day"""
+    start, end = day_bounds(summary.day, tz)
+    # iter_positions includes its end
+    positions = iter_positions(summary.user_id, start, end - timedelta(microseconds=1))
+    summarize_points(
+        summary,
+        [(pos.timestamp, pos.latitude, pos.longitude, pos.speed) for pos in positions],
+    )
+
+
+def rebuild_day_summaries(user, timezone=None):
+    """Recompute all of a user's day summaries from their GPS points, in
+    ``timezone`` or the user's own, committing REBUILD_BATCH_DAYS days at a
+    time.
+
+    Needed after the user's timezone changes, since that moves the boundaries
+    of every day. The first commit clears the summaries and sets the user's
+    timezone; until the last, user.summaries_complete_before is the first day
+    not rebuilt yet, and pending ranges are left for after the rebuild.
+    """
+    timezone = timezone or user.timezone
+    tz = pytz.timezone(timezone)
+    # Every point is summarized below, including those still pending
+    db.session.execute(
+        delete(GPSPendingRange).where(GPSPendingRange.user_id == user.id)
+    )
+    db.session.execute(delete(GPSDaySummary).where(GPSDaySummary.user_id == user.id))
+    user.timezone = timezone
+    user.summaries_complete_before = date.min
+    db.session.commit()
+
+    first, last = _history_span(user.id)
+    if first is not None:
+        day, final_day = local_day(first, tz), local_day(last, tz)
+        while day <= final_day:
+            last_day = min(day + timedelta(days=REBUILD_BATCH_DAYS - 1), final_day)
+            start, _ = day_bounds(day, tz)
+            _, end = day_bounds(last_day, tz)
+            # iter_positions includes its end
+            positions = iter_positions(user.id, start, end - timedelta(microseconds=1))
+            _add_summaries(user.id, tz, positions)
+            day = user.summaries_complete_before = last_day + timedelta(days=1)
+            db.session.commit()
+
+    user.summaries_complete_before = None
+    db.session.commit()
+
+
+def _history_span(user_id):
+    # The first and last timestamps of the user's points in either tier
+    first, last = db.session.execute(
+        select(func.min(GPSPosition.timestamp), func.max(GPSPosition.timestamp)).where(
+            GPSPosition.user_id == user_id
+        )
+    ).one()
+    archived_first, archived_last = db.session.execute(
+        select(
+            func.min(GPSArchive.first_timestamp), func.max(GPSArchive.last_timestamp)
+        ).where(GPSArchive.user_id == user_id)
+    ).one()
+    return _min(first, archived_first), _max(last, archived_last)
+
+
+def _add_summaries(user_id, tz, positions):
+    day = None
+    points = []
+    for pos in positions:
+        pos_day = local_day(pos.timestamp, tz)
+        if pos_day != day and points:
+            _add_summary(user_id, day, points)
+            points = []
+        day = pos_day
+        points.append((pos.timestamp, pos.latitude, pos.longitude, pos.speed))
+
+    if points:
+        _add_summary(user_id, day, points)
+
+
+def _add_summary(user_id, day, points):
+    summary = GPSDaySummary(user_id=user_id, day=day)
+    summarize_points(summary, points)
+    db.session.add(summary)
+
+
+def timezone_changed(user, timezone):
+    """Whether ``timezone`` is a known timezone other than the one the user's
+    day summaries are kept in"""
+    if not timezone or timezone == user.timezone:
+        return False
+    try:
+        pytz.timezone(timezone)
+    except pytz.UnknownTimeZoneError:
+        return False
+    return True
+
+
+def user_timezones(user_ids):
+    """Map user ids to their pytz timezones"""
+    return {
+        user_id: pytz.timezone(timezone)
+        for user_id, timezone in db.session.execute(
+            select(User.id, User.timezone).where(User.id.in_(user_ids))
+        )
+    }
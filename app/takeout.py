@@ -0,0 +1,155 @@
+import codecs
+import json
+from datetime import datetime
+
+import pytz
+
+from .ingest import parse_timestamp
+
+# GPSPosition.source of points imported from Google location history
+TAKEOUT_SOURCE = "google_takeout"
+
+# Largest single location record accepted before the file is considered corrupt
+MAX_RECORD_SIZE = 1024 * 1024
+
+
+class LocationHistoryReader:
+    """Incrementally read the ``locations`` array of a Google Takeout
+    location history export (Records.json).
+
+    Records are decoded one at a time from a binary file object, so memory use
+    does not grow with the size of the export. ``offset`` is the byte position
+    just after the last record returned; passing it back in when the same file
+    is opened again resumes reading at the next record.
+    """
+
+    def __init__(self, file, offset=0, block_size=64 * 1024):
+        self.file = file
+        self.block_size = block_size
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._buffer_offset = offset
+        self._resumed = offset > 0
+        if offset:
+            file.seek(offset)
+
+    @property
+    def offset(self):
+        return self._buffer_offset + len(self._buffer[: self._pos].encode("utf-8"))
+
+    def _fill(self):
+        # Drop the text that has been read and append the next block
+        self._buffer_offset += len(self._buffer[: self._pos].encode("utf-8"))
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        block = self.file.read(self.block_size)
+        self._buffer += self._utf8.decode(block, final=not block)
+        return bool(block)
+
+    def _skip_to_locations(self):
+        key = '"locations"'
+        while True:
+            start = self._buffer.find(key, self._pos)
+            if start >= 0:
+                array_start = self._buffer.find("[", start)
+                if array_start >= 0:
+                    self._pos = array_start + 1
+                    return
+                self._pos = start
+            else:
+                # Keep enough text to match a key split across two blocks
+                self._pos = max(self._pos, len(self._buffer) - len(key))
+
+            if not self._fill():
+                raise ValueError("No locations array found")
+
+    def __iter__(self):
+        if not self._resumed:
+            self._skip_to_locations()
+
+        while True:
+            # Skip the separator before the next record
+            while True:
+                while (
+                    self._pos < len(self._buffer)
+                    and self._buffer[self._pos] in " \t\r\n,"
+                ):
+                    self._pos += 1
+                if self._pos < len(self._buffer):
+                    break
+                if not self._fill():
+                    return
+
+            if self._buffer[self._pos] == "]":
+                return
+
+            try:
+                record, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The record is most likely cut off at the end of the buffer
+                if len(self._buffer) - self._pos > MAX_RECORD_SIZE:
+                    raise ValueError(f"Invalid location record at byte {self.offset}")
+                if not self._fill():
+                    raise ValueError(f"Truncated location record at byte {self.offset}")
+                continue
+
+            self._pos = end
+            if isinstance(record, dict):
+                yield record
+
+
+def _e7(value, limit):
+    # Some exports store negative coordinates as unsigned 32-bit integers
+    if value > limit * 10**7:
+        value -= 2**32
+    return value / 10**7
+
+
+def location_row(record, user_id):
+    """Turn a location history record into a GPSPosition row.
+
+    Returns None for records without coordinates or a timestamp.
+    """
+    latitude = record.get("latitudeE7")
+    longitude = record.get("longitudeE7")
+    if latitude is None or longitude is None:
+        return None
+
+    if record.get("timestamp"):
+        timestamp = parse_timestamp(record["timestamp"])
+    elif record.get("timestampMs"):
+        timestamp = datetime.fromtimestamp(
+            int(record["timestampMs"]) / 1000, pytz.UTC
+        ).replace(tzinfo=None)
+    else:
+        return None
+
+    return {
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "latitude": _e7(latitude, 90),
+        "longitude": _e7(longitude, 180),
+        "altitude": record.get("altitude"),
+        "accuracy": record.get("accuracy"),
+        "speed": record.get("velocity"),
+        "bearing": record.get("heading"),
+        "provider": record.get("source"),
+        "source": TAKEOUT_SOURCE,
+    }
+
+
+def location_rows(reader, user_id):
+    """Yield a GPSPosition row for every usable record of ``reader``"""
+    for record in reader:
+        row = location_row(record, user_id)
+        if row is not None:
+            yield row
+
+
+def iter_location_history_file(path, user_id):
+    """Yield the GPSPosition rows of the location history export at ``path``"""
+    with open(path, "rb") as file:
+        yield from location_rows(LocationHistoryReader(file), user_id)
@@ -0,0 +1,277 @@
+import json
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select
+
+from .grid import EARTH_RADIUS
+from .model import GPSPosition
+
+# Media types of the compact track encodings
+POLYLINE_MIMETYPE = "application/vnd.timeline.polyline+json"
+BINARY_MIMETYPE = "application/vnd.timeline.track"
+
+# Track encodings by media type; the first is the default
+TRACK_FORMATS = {
+    "application/json": "geojson",
+    POLYLINE_MIMETYPE: "polyline",
+    BINARY_MIMETYPE: "binary",
+}
+
+# Decimal places kept by the polyline encoding
+POLYLINE_PRECISION = 6
+
+# Rows fetched per round trip, and features per chunk, of streamed responses
+STREAM_BATCH_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+# Ground distance covered by one pixel of a 256px web mercator tile at zoom 0
+# on the equator
+METRES_PER_PIXEL_AT_ZOOM_0 = 156543.03
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance in metres for a map zoom level.
+
+    Vertices closer than one pixel to the simplified line are not visible at
+    that zoom, so the tolerance is the size of a pixel.
+    """
+    return METRES_PER_PIXEL_AT_ZOOM_0 / 2 ** max(0, min(zoom, 24))
+
+
+def _project(points):
+    # Equirectangular projection around the track, accurate enough over the
+    # distances covered by a single track
+    if not points:
+        return []
+    scale = EARTH_RADIUS * math.pi / 180
+    x_scale = scale * math.cos(math.radians(points[0][1]))
+    return [(lon * x_scale, lat * scale) for lon, lat in points]
+
+
+def simplify_track(points, tolerance):
+    """Simplify a track with the Douglas-Peucker algorithm.
+
+    ``points`` is a sequence of (longitude, latitude) pairs and ``tolerance``
+    the largest distance in metres a dropped vertex may lie from the
+    simplified line. Returns the indices of the vertices to keep, in order.
+    """
+    if len(points) < 3 or tolerance <= 0:
+        return list(range(len(points)))
+
+    projected = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_squared = tolerance * tolerance
+
+    # Iterative to avoid the recursion limit on long, winding tracks
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = projected[first]
+        x2, y2 = projected[last]
+        dx = x2 - x1
+        dy = y2 - y1
+        length_squared = dx * dx + dy * dy
+
+        max_distance = -1
+        farthest = None
+        for index in range(first + 1, last):
+            x, y = projected[index]
+            if length_squared:
+                t = ((x - x1) * dx + (y - y1) * dy) / length_squared
+                t = max(0, min(1, t))
+                distance = (x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2
+            else:
+                distance = (x - x1) ** 2 + (y - y1) ** 2
+            if distance > max_distance:
+                max_distance = distance
+                farthest = index
+
+        if farthest is not None and max_distance > tolerance_squared:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [index for index, kept in enumerate(keep) if kept]
+
+
+def positions_query(user_id, start_datetime, end_datetime, bbox=None, after=None):
+    """Select a user's positions between two datetimes, oldest first.
+
+    Either datetime may be None for an open range. ``bbox`` is a (min_lon,
+    min_lat, max_lon, max_lat) tuple and ``after`` the (timestamp, id) of the
+    last row of the previous page.
+
+    Columns are selected rather than GPSPosition objects, so rows are cheap
+    to load and safe to keep in the track cache.
+    """
+    query = (
+        select(
+            GPSPosition.id,
+            GPSPosition.timestamp,
+            GPSPosition.latitude,
+            GPSPosition.longitude,
+            GPSPosition.altitude,
+            GPSPosition.accuracy,
+            GPSPosition.speed,
+            GPSPosition.source,
+        )
+        .where(GPSPosition.user_id == user_id)
+        .order_by(GPSPosition.timestamp, GPSPosition.id)
+    )
+
+    if start_datetime:
+        query = query.where(GPSPosition.timestamp >= start_datetime)
+    if end_datetime:
+        query = query.where(GPSPosition.timestamp <= end_datetime)
+
+    if after:
+        after_timestamp, after_id = after
+        # The first condition alone can use the (user_id, timestamp) index
+        query = query.where(
+            GPSPosition.timestamp >= after_timestamp,
+            or_(
+                GPSPosition.timestamp > after_timestamp,
+                GPSPosition.id > after_id,
+            ),
+        )
+
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        query = query.where(GPSPosition.latitude.between(min_lat, max_lat))
+        if min_lon <= max_lon:
+            query = query.where(GPSPosition.longitude.between(min_lon, max_lon))
+        else:
+            # The box crosses the antimeridian
+            query = query.where(
+                or_(GPSPosition.longitude >= min_lon, GPSPosition.longitude <= max_lon)
+            )
+
+    return query
+
+
+def in_bbox(latitude, longitude, bbox):
+    """Whether a point lies in a bbox, as the ``bbox`` filter of
+    positions_query decides"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not min_lat <= latitude <= max_lat:
+        return False
+    if min_lon <= max_lon:
+        return min_lon <= longitude <= max_lon
+    return longitude >= min_lon or longitude <= max_lon
+
+
+def _epoch_seconds(timestamp):
+    return (timestamp - EPOCH) // timedelta(seconds=1)
+
+
+def encode_polyline(coordinates, precision=POLYLINE_PRECISION):
+    """Encode (latitude, longitude) pairs with Google's polyline algorithm"""
+    factor = 10**precision
+    encoded = []
+    previous_latitude = previous_longitude = 0
+
+    for latitude, longitude in coordinates:
+        latitude = round(latitude * factor)
+        longitude = round(longitude * factor)
+
+        for delta in (latitude - previous_latitude, longitude - previous_longitude):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+
+        previous_latitude = latitude
+        previous_longitude = longitude
+
+    return "".join(encoded)
+
+
+def encode_track_polyline(positions):
+    """Encode positions as a polyline with parallel timestamp and speed arrays.
+
+    Timestamps are epoch seconds, the first absolute and each following one
+    relative to the point before it.
+    """
+    timestamps = []
+    previous = 0
+    for pos in positions:
+        timestamp = _epoch_seconds(pos.timestamp)
+        timestamps.append(timestamp - previous)
+        previous = timestamp
+
+    return {
+        "format": "polyline",
+        "precision": POLYLINE_PRECISION,
+        "coordinates": encode_polyline(
+            (pos.latitude, pos.longitude) for pos in positions
+        ),
+        "timestamps": timestamps,
+        "speed": [
+            round(pos.speed, 1) if pos.speed is not None else None for pos in positions
+        ],
+    }
+
+
+def encode_track_binary(positions):
+    """Encode positions as little-endian typed arrays.
+
+    The layout is the magic bytes ``TRK1`` and a uint32 point count, followed
+    by one array per field: uint32 epoch seconds, int32 latitudes and
+    longitudes in 1e-7 degrees, and float32 speeds with NaN for missing
+    values.
+    """
+    timestamps = array("I", (_epoch_seconds(pos.timestamp) for pos in positions))
+    latitudes = array("i", (round(pos.latitude * 10**7) for pos in positions))
+    longitudes = array("i", (round(pos.longitude * 10**7) for pos in positions))
+    speeds = array(
+        "f",
+        (pos.speed if pos.speed is not None else math.nan for pos in positions),
+    )
+
+    chunks = [b"TRK1", struct.pack("<I", len(positions))]
+    for values in (timestamps, latitudes, longitudes, speeds):
+        if sys.byteorder == "big":
+            values.byteswap()
+        chunks.append(values.tobytes())
+    return b"".join(chunks)
+
+
+def iter_json_array(items, batch_size=STREAM_BATCH_SIZE):
+    """Serialize items into a JSON array piece by piece, yielding chunks of
+    ``batch_size`` items"""
+    yield "["
+    separator = ""
+    batch = []
+    for item in items:
+        batch.append(json.dumps(item, separators=(",", ":")))
+        if len(batch) >= batch_size:
+            yield separator + ",".join(batch)
+            separator = ","
+            batch = []
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]"
+
+
+def iter_feature_collection(features, batch_size=STREAM_BATCH_SIZE, members=None):
+    """Serialize GeoJSON features into a FeatureCollection piece by piece.
+
+    Yields chunks of ``batch_size`` features, so a response can be sent
+    without holding every feature, or the whole document, in memory.
+    ``members`` is an optional callable returning extra top-level members;
+    it is called after the last feature has been read.
+    """
+    yield '{"type":"FeatureCollection","features":'
+    yield from iter_json_array(features, batch_size)
+
+    for key, value in (members() if members else {}).items():
+        yield f",{json.dumps(key)}:{json.dumps(value)}"
+    yield "}"
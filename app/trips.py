@@ -0,0 +1,218 @@
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+
+from .grid import EARTH_RADIUS
+from .tracks import EPOCH
+
+# A stretch of travel between two stays: from the ``start`` to the ``end``
+# point index of the arrays passed to find_trips, inclusive. Distances are in
+# metres, times in seconds and speeds in metres per second.
+Trip = namedtuple(
+    "Trip",
+    [
+        "start",
+        "end",
+        "start_time",
+        "end_time",
+        "distance",
+        "moving_time",
+        "average_speed",
+        "max_speed",
+        "mode",
+    ],
+)
+
+# Steps slower than this are not counted as moving
+MOVING_SPEED = 0.5
+
+# Seconds over which speeds are measured for max_speed, which smooths out
+# the jitter of single steps
+SPEED_WINDOW = 30
+
+# Seconds of points averaged into each position before measuring distance,
+# so GPS noise is not added up as distance travelled
+SMOOTHING_WINDOW = 30
+
+# (mode, highest average moving speed, highest max speed), checked in order
+MODES = [
+    ("walk", 2.2, 4.0),
+    ("bike", 7.0, 14.0),
+    ("drive", np.inf, np.inf),
+]
+
+
+def great_circle_distances(lat_a, lon_a, lat_b, lon_b):
+    """Great circle distances in metres between arrays of points in degrees"""
+    lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+    a = (
+        np.sin((lat_b - lat_a) / 2) ** 2
+        + np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def step_distances(latitudes, longitudes):
+    """Great circle distances in metres between consecutive points"""
+    return great_circle_distances(
+        latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]
+    )
+
+
+def _smooth(times, values, first, last, window):
+    """Mean of ``values`` over the ``window`` seconds around each point,
+    counting only points from ``first`` to ``last`` of that point"""
+    low = np.maximum(np.searchsorted(times, times - window / 2), first)
+    high = np.minimum(np.searchsorted(times, times + window / 2, "right") - 1, last)
+    # Relative to the first value, so the running sum keeps its precision
+    sums = np.concatenate([[0], np.cumsum(values - values[0])])
+    return values[0] + (sums[high + 1] - sums[low]) / (high - low + 1)
+
+
+def find_trips(times, latitudes, longitudes, stays, max_gap, max_jump, min_distance):
+    """Split a track into the trips between its stays.
+
+    Takes arrays of epoch seconds, sorted, and degrees, and the Stay list of
+    visits.detect_stays for them. A trip runs from the last point of one
+    stay to the first point of the next, and is also split where no point
+    was recorded for ``max_gap`` seconds or the track jumps more than
+    ``max_jump`` metres in one step. Trips shorter than ``min_distance``
+    metres are dropped. Returns a list of Trip.
+    """
+    times = np.asarray(times, dtype=float)
+    count = len(times)
+    if count < 2:
+        return []
+
+    # Trips are made of the points that are not inside a stay
+    in_trip = np.ones(count, dtype=bool)
+    for stay in stays:
+        in_trip[stay.start + 1 : stay.end] = False
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    # Unwrapped so steps across the antimeridian stay short
+    longitudes = np.unwrap(np.asarray(longitudes, dtype=float), period=360)
+    durations = np.diff(times)
+    gap = (durations > max_gap) | (step_distances(latitudes, longitudes) > max_jump)
+
+    starts = in_trip.copy()
+    starts[1:] &= ~in_trip[:-1] | gap
+    ends = in_trip.copy()
+    ends[:-1] &= ~in_trip[1:] | gap
+    starts, ends = np.flatnonzero(starts), np.flatnonzero(ends)
+    if not len(starts):
+        return []
+
+    # The first and last point of each point's trip
+    trip_start = np.zeros(count, dtype=int)
+    trip_end = np.full(count, count - 1)
+    trip_start[in_trip] = np.repeat(starts, ends - starts + 1)
+    trip_end[in_trip] = np.repeat(ends, ends - starts + 1)
+
+    smooth_latitudes = _smooth(times, latitudes, trip_start, trip_end, SMOOTHING_WINDOW)
+    smooth_longitudes = _smooth(
+        times, longitudes, trip_start, trip_end, SMOOTHING_WINDOW
+    )
+    steps = step_distances(smooth_latitudes, smooth_longitudes)
+
+    # Steps that belong to a trip; the others join trips to stays or gaps
+    trip_steps = in_trip[:-1] & in_trip[1:] & ~gap
+    steps = np.where(trip_steps, steps, 0)
+    moving = trip_steps & (steps > MOVING_SPEED * durations)
+
+    travelled = np.concatenate([[0], np.cumsum(steps)])
+    moving_time = np.concatenate([[0], np.cumsum(np.where(moving, durations, 0))])
+    # Smoothing is clipped at the ends of a trip, which pulls the first and
+    # last smoothed positions half a window inwards; the raw end points are
+    # joined on so the distance covers the whole trip
+    distances = (
+        travelled[ends]
+        - travelled[starts]
+        + great_circle_distances(
+            latitudes[starts],
+            longitudes[starts],
+            smooth_latitudes[starts],
+            smooth_longitudes[starts],
+        )
+        + great_circle_distances(
+            smooth_latitudes[ends],
+            smooth_longitudes[ends],
+            latitudes[ends],
+            longitudes[ends],
+        )
+    )
+    moving_times = moving_time[ends] - moving_time[starts]
+
+    # Speed over the SPEED_WINDOW seconds from each point, within its trip
+    window_end = np.minimum(np.searchsorted(times, times + SPEED_WINDOW), trip_end)
+    window = times[window_end] - times
+    speeds = np.zeros(count)
+    measured = in_trip & (window >= SPEED_WINDOW / 2)
+    speeds[measured] = (travelled[window_end[measured]] - travelled[measured]) / window[
+        measured
+    ]
+    max_speeds = np.maximum.reduceat(speeds, starts)
+
+    average_speeds = np.divide(
+        distances, moving_times, out=np.zeros_like(distances), where=moving_times > 0
+    )
+    modes = np.select(
+        [
+            (average_speeds <= average) & (max_speeds <= maximum)
+            for _, average, maximum in MODES
+        ],
+        [mode for mode, _, _ in MODES],
+        MODES[-1][0],
+    )
+
+    return [
+        Trip(
+            int(start),
+            int(end),
+            float(times[start]),
+            float(times[end]),
+            float(distance),
+            float(moving),
+            float(average),
+            float(maximum),
+            str(mode),
+        )
+        for start, end, distance, moving, average, maximum, mode in zip(
+            starts, ends, distances, moving_times, average_speeds, max_speeds, modes
+        )
+        if end > start and distance >= min_distance
+    ]
+
+
+def trip_to_dict(trip):
+    return {
+        "start_time": (EPOCH + timedelta(seconds=trip.start_time)).isoformat() + "Z",
+        "end_time": (EPOCH + timedelta(seconds=trip.end_time)).isoformat() + "Z",
+        "duration": round(trip.end_time - trip.start_time),
+        "distance": round(trip.distance, 1),
+        "moving_time": round(trip.moving_time),
+        "average_speed": round(trip.average_speed, 2),
+        "max_speed": round(trip.max_speed, 2),
+        "mode": trip.mode,
+    }
+
+
+def trip_totals(trips):
+    """Combined statistics of trips, as stored on travel events.
+
+    The mode is that of the trip that covered the most distance.
+    """
+    if not trips:
+        return None
+
+    distance = sum(trip.distance for trip in trips)
+    moving_time = sum(trip.moving_time for trip in trips)
+    return {
+        "trips": len(trips),
+        "distance": round(distance, 1),
+        "moving_time": round(moving_time),
+        "average_speed": round(distance / moving_time, 2) if moving_time else 0,
+        "max_speed": round(max(trip.max_speed for trip in trips), 2),
+        "mode": max(trips, key=lambda trip: trip.distance).mode,
+    }
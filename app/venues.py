@@ -0,0 +1,366 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from gpxpy.geo import haversine_distance
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .grid import bbox_around, cell_ranges, grid_cell
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS venue_search (
+    id INTEGER PRIMARY KEY,
+    cell INTEGER NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    covered_radius REAL NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    venues TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_venue_search_cell ON venue_search (cell);
+CREATE INDEX IF NOT EXISTS ix_venue_search_used_at ON venue_search (used_at);
+"""
+
+
+def venues_within(venues, latitude, longitude, radius):
+    """The venue dicts within ``radius`` metres of a point, nearest first"""
+    measured = [
+        (haversine_distance(latitude, longitude, venue["lat"], venue["lon"]), venue)
+        for venue in venues
+    ]
+    return [
+        venue
+        for distance, venue in sorted(measured, key=lambda item: item[0])
+        if distance <= radius
+    ]
+
+
+class VenueCache:
+    """Foursquare venue searches saved in a SQLite file shared by all workers.
+
+    Each search is saved with the grid cell of its centre and the radius it
+    covers: the radius searched, or the distance of the furthest venue when
+    the results were cut off at the limit, as venues come back nearest
+    first. A later search within a saved search's circle is answered from
+    it, so searching a smaller radius or from a few metres away does not
+    call the API again. Searches expire after ``ttl`` seconds, and the least
+    recently used ones are evicted beyond ``max_entries``.
+
+    The cache is only an optimization: errors reading or writing the file
+    are logged to ``logger`` and treated as a miss.
+    """
+
+    def __init__(self, path, ttl, max_entries, logger):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        with self._lock:
+            if not self._ready:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                connection = sqlite3.connect(self.path, timeout=10)
+                with connection:
+                    # WAL lets workers read while another one writes
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript(SCHEMA)
+                connection.close()
+                self._ready = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, latitude, longitude, radius):
+        """The venues within ``radius`` metres of a point, nearest first, from
+        a saved search that covers that circle, or None"""
+        try:
+            return self._get(latitude, longitude, radius)
+        except (sqlite3.Error, OSError):
+            self.logger.exception("Error reading venue cache %s", self.path)
+            return None
+
+    def _get(self, latitude, longitude, radius):
+        ranges = cell_ranges(bbox_around(latitude, longitude, radius))
+        cells = " OR ".join("cell BETWEEN ? AND ?" for _ in ranges)
+        now = time.time()
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT id, latitude, longitude, covered_radius FROM venue_search "
+                f"WHERE ({cells}) AND fetched_at > ?",
+                [cell for cell_range in ranges for cell in cell_range]
+                + [now - self.ttl],
+            ).fetchall()
+
+            # The nearest saved search whose circle contains the whole query
+            search_id, nearest = None, None
+            for row_id, lat, lon, covered_radius in rows:
+                distance = haversine_distance(latitude, longitude, lat, lon)
+                if distance + radius <= covered_radius and (
+                    nearest is None or distance < nearest
+                ):
+                    search_id, nearest = row_id, distance
+            if search_id is None:
+                return None
+
+            with connection:
+                connection.execute(
+                    "UPDATE venue_search SET used_at = ? WHERE id = ?",
+                    (now, search_id),
+                )
+            (venues,) = connection.execute(
+                "SELECT venues FROM venue_search WHERE id = ?", (search_id,)
+            ).fetchone()
+        finally:
+            connection.close()
+
+        return venues_within(json.loads(venues), latitude, longitude, radius)
+
+    def set(self, latitude, longitude, radius, venues, complete):
+        """Save the venues found by a search; ``complete`` is False when the
+        API stopped at the search's limit"""
+        try:
+            self._set(latitude, longitude, radius, venues, complete)
+        except (sqlite3.Error, OSError):
+            self.logger.exception("Error writing venue cache %s", self.path)
+
+    def _set(self, latitude, longitude, radius, venues, complete):
+        covered_radius = radius
+        if not complete:
+            covered_radius = max(
+                (
+                    haversine_distance(latitude, longitude, venue["lat"], venue["lon"])
+                    for venue in venues
+                ),
+                default=0,
+            )
+        now = time.time()
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT INTO venue_search (cell, latitude, longitude, "
+                    "covered_radius, fetched_at, used_at, venues) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        grid_cell(latitude, longitude),
+                        latitude,
+                        longitude,
+                        covered_radius,
+                        now,
+                        now,
+                        json.dumps(venues),
+                    ),
+                )
+                connection.execute(
+                    "DELETE FROM venue_search WHERE fetched_at <= ?",
+                    (now - self.ttl,),
+                )
+                connection.execute(
+                    "DELETE FROM venue_search WHERE id IN (SELECT id FROM "
+                    "venue_search ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            connection.close()
+
+
+def _venue_dict(venue):
+    """The fields of a Foursquare place that checkin uses, or None for places
+    without coordinates"""
+    if "geocodes" not in venue or "main" not in venue["geocodes"]:
+        return None
+
+    # Get category
+    category = (
+        venue.get("categories", [{}])[0].get("name", "Uncategorized")
+        if venue.get("categories")
+        else "Uncategorized"
+    )
+
+    return {
+        "id": venue.get("fsq_id"),
+        "name": venue.get("name"),
+        "category": category,
+        "lat": venue["geocodes"]["main"]["latitude"],
+        "lon": venue["geocodes"]["main"]["longitude"],
+        "address": venue.get("location", {}).get("formatted_address", ""),
+    }
+
+
+class FoursquareClient:
+    """Searches Foursquare for venues, shared by the requests of a process.
+
+    Requests go through one keep-alive connection pool with connect and read
+    timeouts. Connection errors and 429/5xx responses are retried with
+    backoff, but read timeouts are not, so a slow API costs each check-in at
+    most one read timeout. After FOURSQUARE_BREAKER_THRESHOLD failures in a
+    row the circuit opens: searches fail at once for
+    FOURSQUARE_BREAKER_RESET seconds, and then a single search is let
+    through to test the API again. Answers come from the VenueCache first.
+    """
+
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+        self.url = app.config["FOURSQUARE_API_URL"]
+        self.api_key = app.config.get("FOURSQUARE_API_KEY")
+        self.margin = app.config["FOURSQUARE_CACHE_MARGIN"]
+        self.timeout = (
+            app.config["FOURSQUARE_CONNECT_TIMEOUT"],
+            app.config["FOURSQUARE_READ_TIMEOUT"],
+        )
+        self.breaker_threshold = app.config["FOURSQUARE_BREAKER_THRESHOLD"]
+        self.breaker_reset = app.config["FOURSQUARE_BREAKER_RESET"]
+
+        retries = app.config["FOURSQUARE_RETRIES"]
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=app.config["FOURSQUARE_RETRY_BACKOFF"],
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            # A long Retry-After would hold the check-in page; fail instead
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_maxsize=app.config["FOURSQUARE_POOL_SIZE"], max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {"Accept": "application/json", "Authorization": self.api_key or ""}
+        )
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "cache_hits": 0,
+            "short_circuits": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def search(self, latitude, longitude, radius, limit):
+        """Venue dicts within ``radius`` metres of a point, nearest first.
+
+        Returns None, rather than an empty list, when the API is failing or
+        the circuit is open, so callers can tell the user.
+        """
+        if not self.api_key:
+            return []
+
+        # Earlier searches around here are shared by all workers
+        cached = self.cache.get(latitude, longitude, radius)
+        if cached is not None:
+            self._count("cache_hits")
+            return cached[:limit]
+
+        if not self._allow_request():
+            self._count("short_circuits")
+            return None
+
+        # Search a little further than asked, so that the saved search also
+        # answers check-ins from nearby
+        search_radius = radius + self.margin
+        params = {
+            "ll": f"{latitude},{longitude}",
+            "radius": int(search_radius),
+            "limit": limit,
+            "sort": "distance",
+        }
+
+        started = time.perf_counter()
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self._record(time.perf_counter() - started, error=e)
+            return None
+        self._record(time.perf_counter() - started)
+
+        places = data.get("results", [])
+        results = [venue for venue in map(_venue_dict, places) if venue]
+        self.cache.set(latitude, longitude, search_radius, results, len(places) < limit)
+        return venues_within(results, latitude, longitude, radius)[:limit]
+
+    @property
+    def circuit_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def stats(self):
+        """Counters of this process's searches, with latencies in ms"""
+        with self._lock:
+            counters = dict(self._counters)
+            circuit_open = self._opened_at is not None
+        latency_total = counters.pop("latency_total")
+        calls = counters["requests"]
+        counters["latency_mean_ms"] = (
+            round(latency_total / calls * 1000, 1) if calls else None
+        )
+        counters["latency_max_ms"] = round(counters.pop("latency_max") * 1000, 1)
+        counters["circuit_open"] = circuit_open
+        return counters
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.breaker_reset:
+                return False
+            # Let this search test the API; the others wait for another
+            # reset period unless it succeeds
+            self._opened_at = time.monotonic()
+            return True
+
+    def _record(self, elapsed, error=None):
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["latency_total"] += elapsed
+            self._counters["latency_max"] = max(self._counters["latency_max"], elapsed)
+
+            if error is None:
+                closed = self._opened_at is not None
+                self._failures = 0
+                self._opened_at = None
+            else:
+                self._counters["errors"] += 1
+                self._failures += 1
+                opened = (
+                    self._opened_at is None and self._failures >= self.breaker_threshold
+                )
+                if opened:
+                    self._opened_at = time.monotonic()
+
+        if error is not None:
+            self.app.logger.warning("Foursquare search failed: %s", error)
+            if opened:
+                self.app.logger.warning(
+                    "Foursquare circuit opened after %d failures; "
+                    "showing saved locations only for %ss",
+                    self.breaker_threshold,
+                    self.breaker_reset,
+                )
+        elif closed:
+            self.app.logger.info("Foursquare circuit closed")
@@ -0,0 +1,264 @@
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from .archive import iter_positions
+from .grid import EARTH_RADIUS
+from .model import Event, Location
+from .tracks import EPOCH
+
+# A place the user stayed: from the ``start`` to the ``end`` point index of
+# the arrays passed to detect_stays, inclusive
+Stay = namedtuple(
+    "Stay",
+    ["start", "end", "start_time", "end_time", "latitude", "longitude", "point_count"],
+)
+
+# Points checked for the end of a stay per step; doubled while a stay lasts
+STAY_SCAN_SIZE = 512
+
+# Points whose candidacy is computed at once, to bound temporary arrays
+CANDIDATE_CHUNK_SIZE = 1 << 20
+
+
+def distances(lat_a, lon_a, lat_b, lon_b):
+    """Distances in metres between points, or arrays of points, in degrees.
+
+    Uses an equirectangular projection around the first point, which is
+    accurate to well under a percent over the few kilometres stays span.
+    """
+    # Longitude differences wrap around the antimeridian
+    dx = ((lon_b - lon_a + 180) % 360 - 180) * np.cos(np.radians(lat_a))
+    return EARTH_RADIUS * np.radians(np.hypot(dx, lat_b - lat_a))
+
+
+def _mean_longitude(longitudes, reference, weights=None):
+    # Average relative to a reference point so positions either side of the
+    # antimeridian do not average to the other side of the world
+    relative = (np.asarray(longitudes) - reference + 180) % 360 - 180
+    return (reference + np.average(relative, weights=weights) + 180) % 360 - 180
+
+
+def _stay_candidates(times, latitudes, longitudes, radius, min_duration):
+    """Whether a stay could start at each point.
+
+    A stay starting at point i must still be within ``radius`` of it at the
+    first point ``min_duration`` seconds later, so checking that one point
+    rules out nearly every point recorded on the move.
+    """
+    count = len(times)
+    candidates = np.zeros(count, dtype=bool)
+    for first in range(0, count, CANDIDATE_CHUNK_SIZE):
+        last = min(first + CANDIDATE_CHUNK_SIZE, count)
+        later = np.searchsorted(times, times[first:last] + min_duration)
+        in_range = later < count
+        later = np.minimum(later, count - 1)
+        candidates[first:last] = in_range & (
+            distances(
+                latitudes[first:last],
+                longitudes[first:last],
+                latitudes[later],
+                longitudes[later],
+            )
+            <= radius
+        )
+    return candidates
+
+
+def _stay_end(times, latitudes, longitudes, anchor, radius):
+    """Index of the last point after ``anchor`` that is within ``radius`` of
+    it with no point further away in between"""
+    count = len(times)
+    start = anchor + 1
+    size = STAY_SCAN_SIZE
+    while start < count:
+        stop = min(start + size, count)
+        outside = np.flatnonzero(
+            distances(
+                latitudes[anchor],
+                longitudes[anchor],
+                latitudes[start:stop],
+                longitudes[start:stop],
+            )
+            > radius
+        )
+        if len(outside):
+            return start + outside[0] - 1
+        start = stop
+        size *= 2
+    return count - 1
+
+
+def detect_stays(times, latitudes, longitudes, radius, min_duration):
+    """Find the places a track stayed within ``radius`` metres for at least
+    ``min_duration`` seconds.
+
+    Takes arrays of epoch seconds, sorted, and degrees. This is the classic
+    stay point algorithm (a stay runs from an anchor point to the last point
+    before one more than ``radius`` away), but only the points that pass the
+    vectorized candidate check are visited one by one. Returns a list of
+    Stay, with the mean position of each stay's points.
+    """
+    times = np.asarray(times, dtype=float)
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+
+    candidates = np.flatnonzero(
+        _stay_candidates(times, latitudes, longitudes, radius, min_duration)
+    )
+
+    stays = []
+    position = 0
+    while position < len(candidates):
+        anchor = candidates[position]
+        end = _stay_end(times, latitudes, longitudes, anchor, radius)
+        if times[end] - times[anchor] >= min_duration:
+            stays.append(
+                Stay(
+                    int(anchor),
+                    int(end),
+                    float(times[anchor]),
+                    float(times[end]),
+                    float(latitudes[anchor : end + 1].mean()),
+                    float(
+                        _mean_longitude(
+                            longitudes[anchor : end + 1], longitudes[anchor]
+                        )
+                    ),
+                    int(end - anchor + 1),
+                )
+            )
+            # The next stay can only start after this one
+            position = np.searchsorted(candidates, end + 1)
+        else:
+            position += 1
+
+    return stays
+
+
+def merge_stays(stays, radius, max_gap):
+    """Join consecutive stays at the same place separated by less than
+    ``max_gap`` seconds, such as one split by a burst of GPS noise"""
+    merged = []
+    for stay in stays:
+        if merged:
+            previous = merged[-1]
+            distance = distances(
+                previous.latitude, previous.longitude, stay.latitude, stay.longitude
+            )
+            if stay.start_time - previous.end_time <= max_gap and distance <= radius:
+                # Weight the positions by the number of points in each stay
+                weights = [previous.point_count, stay.point_count]
+                merged[-1] = previous._replace(
+                    end=stay.end,
+                    end_time=stay.end_time,
+                    latitude=float(
+                        np.average([previous.latitude, stay.latitude], weights=weights)
+                    ),
+                    longitude=float(
+                        _mean_longitude(
+                            [previous.longitude, stay.longitude],
+                            previous.longitude,
+                            weights,
+                        )
+                    ),
+                    point_count=previous.point_count + stay.point_count,
+                )
+                continue
+        merged.append(stay)
+    return merged
+
+
+def track_arrays(positions):
+    """Arrays of epoch seconds, latitudes and longitudes of position rows"""
+    rows = [
+        ((pos.timestamp - EPOCH).total_seconds(), pos.latitude, pos.longitude)
+        for pos in positions
+    ]
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0)
+    # Copied so each array is contiguous
+    times, latitudes, longitudes = np.array(rows, dtype=float).T.copy()
+    return times, latitudes, longitudes
+
+
+def match_locations(stays, locations, radius):
+    """The nearest of ``locations`` within ``radius`` metres of each stay, or
+    None, with its distance"""
+    if not stays or not locations:
+        return [(None, None)] * len(stays)
+
+    stay_lats = np.array([stay.latitude for stay in stays])[:, np.newaxis]
+    stay_lons = np.array([stay.longitude for stay in stays])[:, np.newaxis]
+    location_lats = np.array([location.latitude for location in locations])
+    location_lons = np.array([location.longitude for location in locations])
+
+    matrix = distances(stay_lats, stay_lons, location_lats, location_lons)
+    nearest = matrix.argmin(axis=1)
+    return [
+        (locations[index], float(distance)) if distance <= radius else (None, None)
+        for index, distance in zip(nearest, matrix[np.arange(len(stays)), nearest])
+    ]
+
+
+def suggest_events(
+    user_id, start, end, radius, min_duration, merge_gap, location_radius
+):
+    """Suggested events for the places a user stayed between two naive UTC
+    datetimes.
+
+    Stays are found with detect_stays and merge_stays, and named after the
+    nearest saved Location within ``location_radius`` metres. Stays that
+    overlap one of the user's events are left out. Returns a list of dicts,
+    oldest first.
+    """
+    times, latitudes, longitudes = track_arrays(iter_positions(user_id, start, end))
+    stays = detect_stays(times, latitudes, longitudes, radius, min_duration)
+    stays = merge_stays(stays, radius, merge_gap)
+
+    events = Event.query.filter(
+        Event.user_id == user_id,
+        Event.start_time <= end,
+        func.coalesce(Event.end_time, Event.start_time) >= start,
+    ).all()
+
+    def overlaps_event(start_time, end_time):
+        return any(
+            event.start_time <= end_time
+            and (event.end_time or event.start_time) >= start_time
+            for event in events
+        )
+
+    locations = Location.query.filter_by(user_id=user_id).all()
+    matches = match_locations(stays, locations, location_radius)
+
+    suggestions = []
+    for stay, (location, distance) in zip(stays, matches):
+        start_time = EPOCH + timedelta(seconds=stay.start_time)
+        end_time = EPOCH + timedelta(seconds=stay.end_time)
+        if overlaps_event(start_time, end_time):
+            continue
+
+        suggestions.append(
+            {
+                "title": location.place_name if location else "Visit",
+                "start_time": start_time.isoformat() + "Z",
+                "end_time": end_time.isoformat() + "Z",
+                "duration": round(stay.end_time - stay.start_time),
+                "latitude": stay.latitude,
+                "longitude": stay.longitude,
+                "point_count": stay.point_count,
+                "location": (
+                    {
+                        "id": location.id,
+                        "place_name": location.place_name,
+                        "distance": round(distance, 1),
+                    }
+                    if location
+                    else None
+                ),
+            }
+        )
+    return suggestions
@@ -0,0 +1,193 @@
+"""Measure the Foursquare venue cache against a local stub of the API.
+
+A stub server answers /v3/places/search from a fixed set of synthetic
+venues, nearest first, after a simulated network delay. Check-ins are then
+simulated from a handful of places, a few metres apart each time and with
+varying radii, and FoursquareClient searches are timed with the cache
+disabled and enabled. The cached results must match what the API returns.
+Finally the stub stops answering, to show the read timeout and circuit
+breaker bounding how long check-ins wait.
+
+Usage: python benchmarks/foursquare_venues.py [--checkins 500] [--latency 0.15]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from gpxpy.geo import haversine_distance
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import create_app  # noqa: E402
+from app.venues import FoursquareClient, VenueCache  # noqa: E402
+
+CENTER = (44.97, -93.26)
+PLACES = [(44.95, -93.25), (44.98, -93.27), (44.981, -93.262), (44.93, -93.2)]
+RADII = [500, 500, 500, 300, 200]
+
+
+def generate_venues(count, rng):
+    return [
+        {
+            "fsq_id": f"venue{i}",
+            "name": f"Venue {i}",
+            "categories": [{"name": "Cafe"}],
+            "geocodes": {
+                "main": {
+                    "latitude": CENTER[0] + rng.uniform(-0.08, 0.08),
+                    "longitude": CENTER[1] + rng.uniform(-0.1, 0.1),
+                }
+            },
+            "location": {"formatted_address": f"{i} Main St"},
+        }
+        for i in range(count)
+    ]
+
+
+class StubFoursquare(ThreadingHTTPServer):
+    """Answers place searches like the Foursquare API, after ``latency``
+    seconds"""
+
+    daemon_threads = True
+
+    def __init__(self, venues, latency):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.venues = venues
+        self.latency = latency
+        self.requests = 0
+        self.hanging = False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/v3/places/search"
+
+    def search(self, latitude, longitude, radius, limit):
+        measured = []
+        for venue in self.venues:
+            geocode = venue["geocodes"]["main"]
+            distance = haversine_distance(
+                latitude, longitude, geocode["latitude"], geocode["longitude"]
+            )
+            if distance <= radius:
+                measured.append((distance, venue))
+        measured.sort(key=lambda item: item[0])
+        return [venue for _, venue in measured[:limit]]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        if self.server.hanging:
+            time.sleep(5)
+
+        query = parse_qs(urlparse(self.path).query)
+        latitude, longitude = map(float, query["ll"][0].split(","))
+        results = self.server.search(
+            latitude, longitude, float(query["radius"][0]), int(query["limit"][0])
+        )
+
+        body = json.dumps({"results": results}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and went away
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def checkins(count, rng):
+    for _ in range(count):
+        latitude, longitude = rng.choice(PLACES)
+        # GPS fixes land a few metres apart from one visit to the next
+        yield (
+            latitude + rng.gauss(0, 0.0002),
+            longitude + rng.gauss(0, 0.0003),
+            rng.choice(RADII),
+        )
+
+
+def make_client(server, cache_ttl, cache_path):
+    app = create_app("testing")
+    app.config.update(
+        FOURSQUARE_API_KEY="benchmark",
+        FOURSQUARE_API_URL=server.url,
+        FOURSQUARE_READ_TIMEOUT=1,
+    )
+    return FoursquareClient(
+        app, VenueCache(cache_path, cache_ttl, 10000, logger=app.logger)
+    )
+
+
+def run(client, server, points):
+    server.requests = 0
+    latencies, results = [], []
+    for latitude, longitude, radius in points:
+        started = time.perf_counter()
+        venues = client.search(latitude, longitude, radius, limit=50)
+        latencies.append(time.perf_counter() - started)
+        results.append(None if venues is None else [venue["id"] for venue in venues])
+    return latencies, results, server.requests
+
+
+def report(label, latencies, requests):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    print(
+        f"{label}: {requests} API calls for {count} check-ins "
+        f"(hit rate {1 - requests / count:.0%}), "
+        f"mean {sum(latencies) / count * 1000:.1f} ms, "
+        f"p95 {latencies[int(count * 0.95)] * 1000:.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkins", type=int, default=500)
+    parser.add_argument("--venues", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    server = StubFoursquare(generate_venues(args.venues, rng), args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    points = list(checkins(args.checkins, rng))
+
+    with tempfile.TemporaryDirectory() as folder:
+        cache_path = os.path.join(folder, "foursquare_cache.sqlite")
+        uncached = run(make_client(server, 0, cache_path), server, points)
+        cached = run(make_client(server, 3600, cache_path), server, points)
+
+        # The API stops answering; nothing can come from the cache
+        server.hanging = True
+        client = make_client(server, 0, cache_path)
+        failing = run(client, server, points[:20])
+
+    server.shutdown()
+    report("uncached", uncached[0], uncached[2])
+    report("cached  ", cached[0], cached[2])
+    print("same venues:", uncached[1] == cached[1])
+    latencies = failing[0]
+    print(
+        f"hanging : {len(latencies)} check-ins waited "
+        f"{sum(latencies):.1f}s in total, at most {max(latencies):.1f}s each"
+    )
+    print("client stats:", client.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compare the streaming GPX importer with the original per-point ORM import.
+
+Generates a synthetic GPX track, imports it into a fresh in-memory SQLite
+database with each implementation, and reports points/second and the peak
+Python heap allocation measured by tracemalloc.
+
+Usage: python benchmarks/gpx_import.py [--points 200000] [--chunk-size 1000]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import gpxpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import create_app, db  # noqa: E402
+from app.gpx import import_gpx_stream  # noqa: E402
+from app.model import GPSPosition, User  # noqa: E402
+
+
+def generate_gpx(points):
+    start = datetime(2024, 1, 1)
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">',
+        "<trk><trkseg>",
+    ]
+    for i in range(points):
+        timestamp = (start + timedelta(seconds=i)).isoformat()
+        lines.append(
+            f'<trkpt lat="{45 + i * 1e-6:.7f}" lon="{-93 + i * 1e-6:.7f}">'
+            f"<ele>{250 + (i % 100) / 10:.1f}</ele><time>{timestamp}Z</time></trkpt>"
+        )
+    lines.append("</trkseg></trk></gpx>")
+    return "\n".join(lines).encode()
+
+
+def import_with_orm(data, user_id, chunk_size):
+    """The original import: build the whole document, then one ORM object per point"""
+    gpx = gpxpy.parse(io.StringIO(data.decode()))
+    for track in gpx.tracks:
+        for segment in track.segments:
+            for point in segment.points:
+                db.session.add(
+                    GPSPosition(
+                        user_id=user_id,
+                        timestamp=point.time,
+                        latitude=point.latitude,
+                        longitude=point.longitude,
+                        altitude=point.elevation,
+                        speed=point.speed,
+                        source="gpx_import",
+                    )
+                )
+    db.session.commit()
+
+
+def import_streaming(data, user_id, chunk_size):
+    import_gpx_stream(io.BytesIO(data), user_id, chunk_size)
+    db.session.commit()
+
+
+def measure(importer, data, points, chunk_size, trace_memory):
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        user = User(username="benchmark", email="benchmark@example.com")
+        db.session.add(user)
+        db.session.commit()
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        importer(data, user.id, chunk_size)
+        elapsed = time.perf_counter() - started
+        peak = 0
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        assert GPSPosition.query.count() == points
+        db.session.remove()
+        db.drop_all()
+
+    return elapsed, peak
+
+
+def run(name, importer, data, points, chunk_size):
+    # tracemalloc slows allocation down, so time and memory are measured apart
+    elapsed, _ = measure(importer, data, points, chunk_size, trace_memory=False)
+    _, peak = measure(importer, data, points, chunk_size, trace_memory=True)
+
+    print(
+        f"{name:<10} {points / elapsed:>12,.0f} points/s "
+        f"{elapsed:>8.2f} s {peak / 1024 / 1024:>10.1f} MiB peak"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=200_000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    data = generate_gpx(args.points)
+    print(f"{args.points:,} points, {len(data) / 1024 / 1024:.1f} MiB of GPX")
+
+    run("orm", import_with_orm, data, args.points, args.chunk_size)
+    run("streaming", import_streaming, data, args.points, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Time stay point detection on a synthetic year of 1 Hz GPS data.
+
+Each simulated day is spent at home, at work and at a lunch spot, with
+drives and a walk in between and metres of GPS noise throughout. The
+vectorized detector is compared with a plain Python loop over every point
+on the first few days, which must find the same stays.
+
+Usage: python benchmarks/stay_points.py [--days 365] [--reference-days 7]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.visits import detect_stays, distances  # noqa: E402
+
+HOME = (44.95, -93.25)
+WORK = (44.98, -93.27)
+LUNCH = (44.981, -93.262)
+
+# (seconds since midnight at which the leg ends, place or None while moving)
+DAY_PLAN = [
+    (8 * 3600, HOME),
+    (8 * 3600 + 1500, None),
+    (12 * 3600, WORK),
+    (12 * 3600 + 600, None),
+    (13 * 3600, LUNCH),
+    (13 * 3600 + 600, None),
+    (17 * 3600 + 1800, WORK),
+    (18 * 3600 + 300, None),
+    (24 * 3600, HOME),
+]
+
+
+def generate_day(day, rng):
+    seconds = np.arange(24 * 3600, dtype=float)
+    latitudes = np.empty_like(seconds)
+    longitudes = np.empty_like(seconds)
+
+    start, previous_place = 0, HOME
+    for end, place in DAY_PLAN:
+        if place:
+            latitudes[start:end], longitudes[start:end] = place
+        else:
+            # Move in a straight line to the next place
+            next_place = DAY_PLAN[DAY_PLAN.index((end, place)) + 1][1]
+            fraction = np.linspace(0, 1, end - start)
+            latitudes[start:end] = previous_place[0] + fraction * (
+                next_place[0] - previous_place[0]
+            )
+            longitudes[start:end] = previous_place[1] + fraction * (
+                next_place[1] - previous_place[1]
+            )
+        previous_place = place or previous_place
+        start = end
+
+    # About 5 m of noise
+    latitudes += rng.normal(0, 0.00005, len(seconds))
+    longitudes += rng.normal(0, 0.00007, len(seconds))
+    return day * 86400 + seconds, latitudes, longitudes
+
+
+def generate(days):
+    rng = np.random.default_rng(1)
+    parts = [generate_day(day, rng) for day in range(days)]
+    return [np.concatenate(column) for column in zip(*parts)]
+
+
+def detect_stays_reference(times, latitudes, longitudes, radius, min_duration):
+    """The classic stay point algorithm, one point at a time"""
+    stays = []
+    count = len(times)
+    i = 0
+    while i < count:
+        j = i + 1
+        while j < count:
+            if (
+                distances(latitudes[i], longitudes[i], latitudes[j], longitudes[j])
+                > radius
+            ):
+                break
+            j += 1
+        if times[j - 1] - times[i] >= min_duration:
+            stays.append((i, j - 1))
+            i = j
+        else:
+            i += 1
+    return stays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--reference-days", type=int, default=7)
+    parser.add_argument("--radius", type=float, default=100)
+    parser.add_argument("--min-duration", type=float, default=600)
+    args = parser.parse_args()
+
+    times, latitudes, longitudes = generate(args.days)
+    print(f"{len(times):,} points over {args.days} days")
+
+    started = time.perf_counter()
+    stays = detect_stays(times, latitudes, longitudes, args.radius, args.min_duration)
+    elapsed = time.perf_counter() - started
+    print(
+        f"vectorized: {len(stays):,} stays in {elapsed:.2f}s "
+        f"({len(times) / elapsed:,.0f} points/s)"
+    )
+
+    if args.reference_days:
+        count = args.reference_days * 86400
+        sample = times[:count], latitudes[:count], longitudes[:count]
+        started = time.perf_counter()
+        expected = detect_stays_reference(*sample, args.radius, args.min_duration)
+        elapsed = time.perf_counter() - started
+        print(
+            f"reference:  {len(expected):,} stays in {args.reference_days} days "
+            f"in {elapsed:.2f}s ({count / elapsed:,.0f} points/s)"
+        )
+        found = [
+            (stay.start, stay.end)
+            for stay in detect_stays(*sample, args.radius, args.min_duration)
+        ]
+        print("same stays:", found == expected)
+
+
+if __name__ == "__main__":
+    main()
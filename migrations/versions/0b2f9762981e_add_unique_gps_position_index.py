@@ -0,0 +1,38 @@
+"""Add unique GPS position index.
+
+Revision ID: 0b2f9762981e
+Revises: 10d568cd0cae
+Create Date: 2026-10-18 19:35:12.418306
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0b2f9762981e"
+down_revision = "10d568cd0cae"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Remove existing duplicates so the unique index can be created
+    op.execute(
+        "DELETE FROM gps_position WHERE id NOT IN ("
+        "SELECT keep.id FROM ("
+        "SELECT MIN(id) AS id FROM gps_position "
+        "GROUP BY user_id, timestamp, source"
+        ") AS keep)"
+    )
+
+    with op.batch_alter_table("gps_position", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_gps_position_user_id_timestamp_source",
+            ["user_id", "timestamp", "source"],
+            unique=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("gps_position", schema=None) as batch_op:
+        batch_op.drop_index("ix_gps_position_user_id_timestamp_source")
@@ -0,0 +1,37 @@
+"""Order GPS points by time within their grid cell index.
+
+"When was I near here" reads one cell at a time in time order, which the
+(user_id, cell) index could not give without sorting every point of the
+cell.
+
+Revision ID: 9f4d6b2a7c15
+Revises: 5c8e2f41a9d3
+Create Date: 2026-10-19 11:02:51.207634
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9f4d6b2a7c15"
+down_revision = "5c8e2f41a9d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("gps_position", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_gps_position_user_id_cell_timestamp",
+            ["user_id", "cell", "timestamp"],
+            unique=False,
+        )
+        batch_op.drop_index("ix_gps_position_user_id_cell")
+
+
+def downgrade():
+    with op.batch_alter_table("gps_position", schema=None) as batch_op:
+        batch_op.create_index(
+            "ix_gps_position_user_id_cell", ["user_id", "cell"], unique=False
+        )
+        batch_op.drop_index("ix_gps_position_user_id_cell_timestamp")
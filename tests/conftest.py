@@ -0,0 +1,34 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.model import User
+
+
+@pytest.fixture
+def app():
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(
+                username="user",
+                email="user@example.com",
+                password_hash=generate_password_hash("password"),
+            )
+        )
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    """A test client logged in as the user, in UTC"""
+    client = app.test_client()
+    client.post(
+        "/login",
+        data={"username": "user", "password": "password", "timezone": "UTC"},
+    )
+    return client
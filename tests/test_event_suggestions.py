@@ -0,0 +1,29 @@
+def test_suggestions_for_range(client):
+    response = client.get(
+        "/api/events/suggestions",
+        query_string={"start": "2024-05-01T00:00:00Z", "end": "2024-05-31T00:00:00Z"},
+    )
+
+    assert response.status_code == 200
+    assert response.json == {"suggestions": []}
+
+
+def test_suggestions_range_too_long(app, client):
+    app.config["EVENT_SUGGESTION_MAX_DAYS"] = 7
+
+    response = client.get(
+        "/api/events/suggestions",
+        query_string={"start": "2024-05-01T00:00:00Z", "end": "2024-05-08T00:00:01Z"},
+    )
+
+    assert response.status_code == 400
+    assert "at most 7 days" in response.json["error"]
+
+
+def test_suggestions_range_reversed(client):
+    response = client.get(
+        "/api/events/suggestions",
+        query_string={"start": "2024-05-02T00:00:00Z", "end": "2024-05-01T00:00:00Z"},
+    )
+
+    assert response.status_code == 400
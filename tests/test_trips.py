@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from app.grid import EARTH_RADIUS
+from app.trips import find_trips
+
+
+def constant_speed_track(speed, duration, interval=1):
+    """Epoch seconds and positions of a trip heading north at ``speed``
+    metres per second"""
+    times = np.arange(0, duration + interval, interval, dtype=float)
+    latitudes = 45 + np.degrees(speed * times / EARTH_RADIUS)
+    longitudes = np.full(len(times), -93.0)
+    return times, latitudes, longitudes
+
+
+@pytest.mark.parametrize(
+    "speed, duration, mode",
+    [
+        (1.4, 60, "walk"),
+        (11.1, 120, "drive"),
+        (11.1, 600, "drive"),
+    ],
+)
+def test_constant_speed_trip_distance(speed, duration, mode):
+    times, latitudes, longitudes = constant_speed_track(speed, duration)
+
+    trips = find_trips(
+        times, latitudes, longitudes, [], max_gap=300, max_jump=1000, min_distance=0
+    )
+
+    assert len(trips) == 1
+    trip = trips[0]
+    assert trip.end_time - trip.start_time == duration
+    assert trip.distance == pytest.approx(speed * duration, rel=0.01)
+    assert trip.mode == mode